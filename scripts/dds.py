@@ -148,6 +148,8 @@ def Main():
   show = manager.Manager(stage)
   SetupStage(stage, show)
   if not FLAGS.oneslide:
+    show.warm_start(os.path.join(config.Option('cache'), 'index.js'))
+    show.manage_cache(config.Option('cache'))
     timer = xmppthread.XMPPThread()
     timer.AttachSlideManager(show)
     timer.start()
@@ -163,8 +165,8 @@ def Main():
       a.oneslide(FLAGS.oneslide, id=-2)
       s.resize(stage.get_width(), stage.get_height())
       a.resize(stage.get_width(), stage.get_height())
-      show._add_slide(s)
-      show._add_slide(a)
+      show.commands.put(None, show._add_slide, s)
+      show.commands.put(None, show._add_slide, a)
     t = threading.Thread(target=foo)
     t.start()
 
@@ -0,0 +1,260 @@
+#!/usr/bin/python
+"""CCIS Crew Digital Display System Frontend/Client
+
+This module extracts slide bundles into slide directories. Each directory
+keeps a manifest of what was extracted into it (member name, size, mtime and
+hash), so an unchanged bundle is not extracted again and a changed one only
+rewrites the members that changed.
+"""
+
+__author__ = 'CCIS Crew <crew@ccs.neu.edu>'
+
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tarfile
+import tempfile
+
+MANIFEST = '.extracted.js'
+CHUNK_SIZE = 64 * 1024
+
+
+def file_sha1(path):
+  """Get the hex SHA-1 of a file's contents."""
+  digest = hashlib.sha1()
+  f = open(path, 'rb')
+  try:
+    while True:
+      data = f.read(CHUNK_SIZE)
+      if not data:
+        break
+      digest.update(data)
+  finally:
+    f.close()
+  return digest.hexdigest()
+
+
+def load_manifest(directory):
+  """Load the extraction manifest of a slide directory.
+
+  Returns:
+     dictionary with 'bundle' (bundle sha1) and 'members' (name ->
+     [size, mtime, sha1]) keys, empty if there is no valid manifest.
+  """
+  try:
+    f = open(os.path.join(directory, MANIFEST))
+    try:
+      return json.load(f)
+    finally:
+      f.close()
+  except (IOError, ValueError):
+    return {}
+
+
+def safe_name(name):
+  """Check that a member name stays inside the directory it extracts to."""
+  normalized = os.path.normpath(name)
+  return not (os.path.isabs(normalized) or normalized == '..' or
+              normalized.startswith('..' + os.sep))
+
+
+class Extractor(object):
+  """Extracts the members of a bundle into a slide directory.
+
+  Changed members are written to a staging directory first and only moved
+  into place by commit(), once the whole bundle has been read.
+  """
+
+  def __init__(self, directory):
+    self.directory = directory
+    self.old = load_manifest(directory).get('members', {})
+    self.members = {}
+    self.staged = []
+    self.staging = tempfile.mkdtemp(prefix='.staging-', dir=directory)
+    self.written = 0
+
+  def current(self, info):
+    """Check whether a member is already on disk as recorded."""
+    entry = self.old.get(info.name)
+    if not entry or entry[0] != info.size or entry[1] != info.mtime:
+      return False
+    path = os.path.join(self.directory, info.name)
+    return os.path.isfile(path) and os.path.getsize(path) == info.size
+
+  def add(self, tar, info):
+    """Extract one member of tar, unless it is already current."""
+    if not safe_name(info.name):
+      logging.warning('Skipping unsafe bundle member %s' % info.name)
+      return
+    if info.isdir():
+      return
+    if not info.isfile():
+      # Links could point outside the directory, and members extracted
+      # through them would follow; devices and fifos have no business here.
+      logging.warning('Skipping bundle member %s that is not a regular file'
+                      % info.name)
+      return
+    if self.current(info):
+      self.members[info.name] = self.old[info.name]
+      return
+    self.add_stream(info.name, tar.extractfile(info), info.mtime)
+
+  def add_stream(self, name, source, mtime):
+    """Stage a member whose content is read from source.
+
+    Returns:
+       the hex SHA-1 of the content
+    """
+    path = os.path.join(self.staging, name)
+    if not os.path.isdir(os.path.dirname(path)):
+      os.makedirs(os.path.dirname(path))
+    digest = hashlib.sha1()
+    size = 0
+    out = open(path, 'wb')
+    try:
+      while True:
+        data = source.read(CHUNK_SIZE)
+        if not data:
+          break
+        digest.update(data)
+        size += len(data)
+        out.write(data)
+    finally:
+      out.close()
+    os.utime(path, (mtime, mtime))
+    sha1 = digest.hexdigest()
+    self.members[name] = [size, mtime, sha1]
+    old = self.old.get(name)
+    target = os.path.join(self.directory, name)
+    if old and old[2] == sha1 and os.path.isfile(target):
+      # Same content, only the mtime moved.
+      os.utime(target, (mtime, mtime))
+      return sha1
+    self.staged.append(name)
+    return sha1
+
+  def commit(self, bundle_sha1):
+    """Move staged members into place and write the manifest."""
+    for name in self.staged:
+      target = os.path.join(self.directory, name)
+      if not os.path.isdir(os.path.dirname(target)):
+        os.makedirs(os.path.dirname(target))
+      if os.path.isdir(target) and not os.path.islink(target):
+        shutil.rmtree(target)
+      os.rename(os.path.join(self.staging, name), target)
+    for name in self.old:
+      if name not in self.members:
+        path = os.path.join(self.directory, name)
+        if os.path.isfile(path):
+          os.remove(path)
+    self.written = len(self.staged)
+    self.abort()
+    tmp = os.path.join(self.directory, MANIFEST + '.tmp')
+    f = open(tmp, 'w')
+    try:
+      json.dump({'bundle': bundle_sha1, 'members': self.members}, f)
+    finally:
+      f.close()
+    os.rename(tmp, os.path.join(self.directory, MANIFEST))
+
+  def abort(self):
+    """Throw away anything staged."""
+    shutil.rmtree(self.staging, ignore_errors=True)
+
+
+def describe(bundle_path):
+  """Build the manifest of a bundle tarball, as a server offers it.
+
+  Returns:
+     dictionary with 'bundle' (bundle sha1) and 'members' (name ->
+     [size, mtime, sha1] for each regular file) keys, the same shape as
+     the extraction manifest.
+  """
+  members = {}
+  tar = tarfile.open(bundle_path)
+  try:
+    for info in tar:
+      if not info.isfile():
+        continue
+      digest = hashlib.sha1()
+      source = tar.extractfile(info)
+      while True:
+        data = source.read(CHUNK_SIZE)
+        if not data:
+          break
+        digest.update(data)
+      members[info.name] = [info.size, info.mtime, digest.hexdigest()]
+  finally:
+    tar.close()
+  return {'bundle': file_sha1(bundle_path), 'members': members}
+
+
+def up_to_date(directory, bundle_sha1):
+  """Check whether directory already holds the bundle with this hash."""
+  manifest = load_manifest(directory)
+  if manifest.get('bundle') != bundle_sha1:
+    return False
+  for name, entry in manifest.get('members', {}).iteritems():
+    path = os.path.join(directory, name)
+    if not os.path.isfile(path) or os.path.getsize(path) != entry[0]:
+      return False
+  return True
+
+
+def add_members(tar, extractor):
+  """Feed every member of tar to extractor, then close tar."""
+  try:
+    for info in tar:
+      extractor.add(tar, info)
+  finally:
+    tar.close()
+
+
+def extract_stream(fileobj, directory):
+  """Extract a bundle read sequentially from fileobj, e.g. a download.
+
+  Members are staged as they are read; nothing is seeked, so the bundle
+  never needs to be on disk.
+
+  Returns:
+     the Extractor holding the staged members. Call its commit() with the
+     bundle hash once known, or abort() if the download fails.
+  """
+  extractor = Extractor(directory)
+  try:
+    add_members(tarfile.open(fileobj=fileobj, mode='r|*'), extractor)
+  except:
+    extractor.abort()
+    raise
+  return extractor
+
+
+def extract(bundle_path, directory, bundle_sha1=None):
+  """Extract a bundle into directory, skipping work that is already done.
+
+  Args:
+     bundle_path: (string) path to the bundle tarball
+     directory: (string) slide directory to extract into
+     bundle_sha1: (string) hash of the bundle if already known
+
+  Returns:
+     number of members written, 0 if the directory was already current
+  """
+  if bundle_sha1 is None:
+    bundle_sha1 = file_sha1(bundle_path)
+  if up_to_date(directory, bundle_sha1):
+    logging.debug('%s already extracted in %s' % (bundle_path, directory))
+    return 0
+  extractor = Extractor(directory)
+  try:
+    add_members(tarfile.open(bundle_path), extractor)
+  except:
+    extractor.abort()
+    raise
+  extractor.commit(bundle_sha1)
+  logging.debug('Extracted %d members of %s into %s'
+                % (extractor.written, bundle_path, directory))
+  return extractor.written
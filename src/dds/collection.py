@@ -6,29 +6,28 @@
 import gflags
 import logging
 import thread
+import collections
 import playlist
+import slideindex
 
 FLAGS = gflags.FLAGS
 
 
 class Collection(object):
     def __init__(self):
-        self.slides = []
+        # slide id -> slide object, kept in insertion order for logging
+        self.slides = collections.OrderedDict()
         self.lock = thread.allocate_lock()
         self.log = logging.getLogger('collection')
         self.playlist = playlist.Playlist()
-        self.currentid = None
-        self.cachedcurrent = None
 
     def empty(self):
         self.log.debug('Checking if empty')
-        with self.lock:
-            return not bool(self.slides)
+        return not self.slides
 
     def has_multiple(self):
         self.log.debug('Checking has multiple')
-        with self.lock:
-            return len(self.slides) > 1
+        return len(self.slides) > 1
 
     def rotate(self, direction='forward'):
         self.playlist.rotate(direction)
@@ -39,10 +38,10 @@ class Collection(object):
     def id_list(self):
         self.log.debug('Getting ID list')
         with self.lock:
-            return [x.id() for x in self.slides]
+            return self.slides.keys()
 
     def id_exists(self, id):
-        return id in self.id_list()
+        return id in self.slides
 
     def get_by_id(self, id):
         """Get the slide with the given id.
@@ -53,38 +52,58 @@ class Collection(object):
         Returns:
            slide object or None if not found
         """
-        with self.lock:
-            for slide in self.slides:
-                if slide.id() == id:
-                    return slide
-        return None
+        return self.slides.get(id)
 
     def log_order(self):
         """Log the current slide order to info log."""
         self.log.info('Current Order: %s' % self.id_list())
 
     def current_slide(self):
+        """Get the slide object for the current playlist entry.
+
+        Looked up every time, as a slide may have been replaced by a newer
+        object with the same id.
+        """
         self.log.debug('Getting current slide')
-        if (self.cachedcurrent is None or
-            self.currentid != self.playlist.current_slide()):
-            self.currentid = self.playlist.current_slide()
-            self.cachedcurrent = self.get_by_id(self.currentid)
-        return self.cachedcurrent
+        return self.get_by_id(self.playlist.current_slide())
 
     def add_slide(self, slideobj):
         self.log.debug('Adding slide %s' % slideobj)
-        if not self.id_exists(slideobj.id()):
-            with self.lock:
-                self.slides.append(slideobj)
-        else:
-            self.log.warning('Slide %s already exists' % slideobj)
+        with self.lock:
+            if slideobj.id() not in self.slides:
+                self.slides[slideobj.id()] = slideobj
+                return
+        self.log.warning('Slide %s already exists' % slideobj)
 
     def remove_slide(self, slideobj):
         self.log.debug('Removing slide %s' % slideobj)
-        if self.id_exists(slideobj.id()):
-            with self.lock:
-                self.slides.remove(slideobj)
-        else:
-            self.log.error('Slide %s does not exist [how did this happen]'
-                           % slideobj)
+        with self.lock:
+            if self.slides.pop(slideobj.id(), None) is not None:
+                return
+        self.log.error('Slide %s does not exist [how did this happen]'
+                       % slideobj)
+
+    def diff_slides(self, metadatas):
+        """Compare slide metadata against the slides in the collection.
+
+        Args:
+           metadatas: (list) slide metadata dictionaries
 
+        Returns:
+           (added, updated, removed) where added and updated are lists of
+           metadata dictionaries and removed is a list of slide ids that are
+           no longer present in metadatas.
+        """
+        added = []
+        updated = []
+        seen = set()
+        for metadata in metadatas:
+            seen.add(metadata['id'])
+            slide = self.get_by_id(metadata['id'])
+            if slide is None:
+                added.append(metadata)
+            elif (slideindex.comparable(slide.timestamp) !=
+                  slideindex.comparable(metadata['modified'])):
+                updated.append(metadata)
+        removed = [id for id in self.id_list() if id not in seen]
+        return added, updated, removed
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# vim: set shiftwidth=4 tabstop=4 softtabstop=4 :
+"""main loop command queue
+"""
+
+import collections
+import gflags
+import gobject
+import itertools
+import logging
+import thread
+import time
+
+FLAGS = gflags.FLAGS
+
+gflags.DEFINE_integer('command_budget', 10,
+                      'Milliseconds of queued commands to run per main loop'
+                      ' iteration')
+
+
+class CommandQueue(object):
+    """Queue of commands run on the GLib main loop.
+
+    Any thread may put commands; they are drained from a gobject idle
+    callback, so everything they touch is only ever touched by the main
+    loop. Commands put with the same key are coalesced: the newer one
+    replaces the older one and moves to the end of the queue, so it still
+    runs after everything that was queued before it. Keys name the kind of
+    command as well as its target, since only a command of the same kind
+    makes an older one redundant (an update does not stand in for an add).
+    """
+    def __init__(self):
+        self.commands = collections.OrderedDict()
+        self.lock = thread.allocate_lock()
+        self.log = logging.getLogger('commandqueue')
+        self.scheduled = False
+        self.unique = itertools.count()
+        # counters
+        self.enqueued = 0
+        self.coalesced = 0
+        self.executed = 0
+        self.failed = 0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+        self.total_latency = 0.0
+
+    def put(self, key, func, *args):
+        """Queue func(*args) to run on the main loop.
+
+        Args:
+           key: hashable coalescing key, or None to never coalesce
+           func: callable to run
+           args: arguments to pass to func
+        """
+        if key is None:
+            key = ('unique', self.unique.next())
+        with self.lock:
+            if self.commands.pop(key, None) is not None:
+                self.coalesced += 1
+            self.commands[key] = (time.time(), func, args)
+            self.enqueued += 1
+            schedule = not self.scheduled
+            self.scheduled = True
+        if schedule:
+            gobject.idle_add(self.drain)
+
+    def depth(self):
+        """Number of commands waiting to run."""
+        return len(self.commands)
+
+    def stats(self):
+        """Get the queue counters as a dictionary. Latencies are seconds."""
+        executed = self.executed or 1
+        return {'depth': self.depth(),
+                'enqueued': self.enqueued,
+                'coalesced': self.coalesced,
+                'executed': self.executed,
+                'failed': self.failed,
+                'last_latency': self.last_latency,
+                'max_latency': self.max_latency,
+                'mean_latency': self.total_latency / executed}
+
+    def drain(self):
+        """Run queued commands for up to --command_budget milliseconds.
+
+        (Executed from a gobject idle callback)
+
+        Returns:
+           True while commands remain, so the idle callback is kept.
+        """
+        deadline = time.time() + FLAGS.command_budget / 1000.0
+        while True:
+            with self.lock:
+                if not self.commands:
+                    self.scheduled = False
+                    return False
+                unused_key, (queued, func, args) = self.commands.popitem(
+                    last=False)
+            latency = time.time() - queued
+            self.last_latency = latency
+            self.max_latency = max(self.max_latency, latency)
+            self.total_latency += latency
+            try:
+                func(*args)
+            except Exception:
+                self.failed += 1
+                self.log.exception('Command %s%s failed' % (func, args))
+            self.executed += 1
+            if time.time() > deadline:
+                return True
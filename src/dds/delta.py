@@ -0,0 +1,124 @@
+#!/usr/bin/python
+"""CCIS Crew Digital Display System Frontend/Client
+
+This module updates an extracted slide bundle by fetching only the members
+that changed.
+
+Next to a bundle at URL, a server supporting delta updates offers
+URL.members.js, the bundle's member manifest ({'bundle': sha1, 'members':
+{name: [size, mtime, sha1]}}, the shape of bundle.load_manifest), and each
+member's content at URL.members/<quoted name>. The local extraction
+manifest is compared with the remote one and only members whose hash
+differs are downloaded, staged and committed through bundle.Extractor.
+deltaserver.py is a stand-in server offering this for a directory of
+bundles.
+"""
+
+__author__ = 'CCIS Crew <crew@ccs.neu.edu>'
+
+
+import bundle
+import download
+import gflags
+import json
+import logging
+import os
+import urllib
+import urllib2
+
+gflags.DEFINE_boolean('delta_bundles', False,
+                      'Update extracted bundles by fetching changed members')
+
+FLAGS = gflags.FLAGS
+
+MANIFEST_SUFFIX = '.members.js'
+MEMBER_SUFFIX = '.members/'
+
+
+class DeltaError(Exception):
+  """A delta update could not be applied."""
+
+
+def manifest_url(url):
+  return url + MANIFEST_SUFFIX
+
+
+def member_url(url, name):
+  return url + MEMBER_SUFFIX + urllib.quote(name)
+
+
+def fetch_manifest(url):
+  """Get the member manifest offered for the bundle at url.
+
+  Returns:
+     the manifest dictionary, or None if the server offers none.
+  """
+  with download.LIMITER.slot(url):
+    try:
+      response = urllib2.urlopen(manifest_url(url))
+    except urllib2.HTTPError, e:
+      if e.code == 404:
+        return None
+      raise
+    try:
+      remote = json.load(response)
+    except ValueError, e:
+      raise DeltaError('bad member manifest for %s: %s' % (url, e))
+    finally:
+      response.close()
+  if 'bundle' not in remote or 'members' not in remote:
+    raise DeltaError('incomplete member manifest for %s' % url)
+  return remote
+
+
+def fetch_member(url, name, extractor, entry):
+  """Stage one member, checking it against its manifest entry."""
+  with download.LIMITER.slot(url):
+    response = urllib2.urlopen(member_url(url, name))
+    try:
+      sha1 = extractor.add_stream(name, response, entry[1])
+    finally:
+      response.close()
+  if sha1 != entry[2]:
+    raise DeltaError('%s of %s hashed %s, expected %s'
+                     % (name, url, sha1, entry[2]))
+
+
+def update(url, directory):
+  """Bring the bundle extracted in directory up to date with url.
+
+  Args:
+     url: (string) URL of the bundle
+     directory: (string) slide directory holding an extracted copy
+
+  Returns:
+     number of members downloaded, or None if the server does not offer
+     delta updates for this bundle.
+  """
+  remote = fetch_manifest(url)
+  if remote is None:
+    return None
+  if bundle.up_to_date(directory, remote['bundle']):
+    logging.debug('%s already current in %s' % (url, directory))
+    return 0
+  extractor = bundle.Extractor(directory)
+  try:
+    for name, entry in sorted(remote['members'].iteritems()):
+      if not bundle.safe_name(name):
+        logging.warning('Skipping unsafe bundle member %s' % name)
+        continue
+      old = extractor.old.get(name)
+      path = os.path.join(directory, name)
+      if (old and old[2] == entry[2] and os.path.isfile(path) and
+          os.path.getsize(path) == entry[0]):
+        os.utime(path, (entry[1], entry[1]))
+        extractor.members[name] = entry
+        continue
+      fetch_member(url, name, extractor, entry)
+  except:
+    extractor.abort()
+    raise
+  extractor.commit(remote['bundle'])
+  logging.info('Delta update of %s fetched %d of %d members'
+               % (url, extractor.written, len(remote['members'])))
+  return extractor.written
@@ -0,0 +1,116 @@
+#!/usr/bin/python
+"""CCIS Crew Digital Display System Frontend/Client
+
+A stand-in bundle server supporting delta updates, for testing them
+without the real backend.
+
+It serves the files under a directory like SimpleHTTPServer, and for each
+bundle tarball BUNDLE also answers BUNDLE.members.js with its member
+manifest and BUNDLE.members/<name> with the content of a member, as
+described in delta.py.
+
+Usage: deltaserver.py [--delta_port=PORT] [--delta_root=DIRECTORY]
+"""
+
+__author__ = 'CCIS Crew <crew@ccs.neu.edu>'
+
+
+import BaseHTTPServer
+import SimpleHTTPServer
+import bundle
+import delta
+import gflags
+import json
+import os
+import sys
+import tarfile
+import thread
+import urllib
+import urlparse
+
+gflags.DEFINE_integer('delta_port', 8000, 'Port the delta server listens on')
+gflags.DEFINE_string('delta_root', '.', 'Directory the delta server serves')
+
+FLAGS = gflags.FLAGS
+
+
+class ManifestCache(object):
+  """Member manifests of bundles, rebuilt when a bundle file changes."""
+
+  def __init__(self):
+    self.lock = thread.allocate_lock()
+    self.manifests = {}
+
+  def get(self, path):
+    stat = os.stat(path)
+    key = (stat.st_mtime, stat.st_size)
+    with self.lock:
+      cached = self.manifests.get(path)
+      if cached and cached[0] == key:
+        return cached[1]
+    manifest = bundle.describe(path)
+    with self.lock:
+      self.manifests[path] = (key, manifest)
+    return manifest
+
+
+MANIFESTS = ManifestCache()
+
+
+class DeltaHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+  """Serves files, plus member manifests and members of bundles."""
+
+  def do_GET(self):
+    path = urllib.unquote(urlparse.urlparse(self.path)[2])
+    if path.endswith(delta.MANIFEST_SUFFIX):
+      self.send_manifest(path[:-len(delta.MANIFEST_SUFFIX)])
+    elif delta.MEMBER_SUFFIX in path:
+      bundle_path, name = path.split(delta.MEMBER_SUFFIX, 1)
+      self.send_member(bundle_path, name)
+    else:
+      SimpleHTTPServer.SimpleHTTPRequestHandler.do_GET(self)
+
+  def send_data(self, data, content_type):
+    self.send_response(200)
+    self.send_header('Content-Type', content_type)
+    self.send_header('Content-Length', str(len(data)))
+    self.end_headers()
+    self.wfile.write(data)
+
+  def send_manifest(self, bundle_path):
+    path = self.translate_path(bundle_path)
+    if not os.path.isfile(path):
+      self.send_error(404, 'No such bundle')
+      return
+    self.send_data(json.dumps(MANIFESTS.get(path)), 'application/json')
+
+  def send_member(self, bundle_path, name):
+    path = self.translate_path(bundle_path)
+    if not os.path.isfile(path):
+      self.send_error(404, 'No such bundle')
+      return
+    tar = tarfile.open(path)
+    try:
+      try:
+        info = tar.getmember(name)
+      except KeyError:
+        info = None
+      if info is None or not info.isfile():
+        self.send_error(404, 'No such member')
+        return
+      self.send_data(tar.extractfile(info).read(),
+                     'application/octet-stream')
+    finally:
+      tar.close()
+
+
+def Main():
+  os.chdir(FLAGS.delta_root)
+  httpd = BaseHTTPServer.HTTPServer(('', FLAGS.delta_port), DeltaHandler)
+  print 'Serving %s on port %d' % (os.getcwd(), FLAGS.delta_port)
+  httpd.serve_forever()
+
+
+if __name__ == '__main__':
+  FLAGS(sys.argv)
+  Main()
@@ -0,0 +1,327 @@
+#!/usr/bin/python
+"""CCIS Crew Digital Display System Frontend/Client
+
+This module fetches slide bundles over HTTP, limiting how many
+connections are open to each host at once. The validators and content hash
+of each download are kept in a small file next to it, so later fetches can
+be conditional and unchanged bundles can be recognised. Interrupted
+downloads are resumed where they stopped and retried with backoff.
+"""
+
+__author__ = 'CCIS Crew <crew@ccs.neu.edu>'
+
+
+import gflags
+import hashlib
+import httplib
+import json
+import logging
+import os
+import random
+import thread
+import threading
+import time
+import urllib2
+import urlparse
+
+gflags.DEFINE_integer('connections_per_host', 2,
+                      'Maximum simultaneous bundle downloads from one host')
+gflags.DEFINE_integer('download_attempts', 4,
+                      'Tries for a bundle download before giving up')
+gflags.DEFINE_float('download_backoff', 1.0,
+                    'Seconds of backoff after the first failed download'
+                    ' attempt, doubling with each further one')
+gflags.DEFINE_float('download_backoff_max', 30.0,
+                    'Maximum seconds of backoff between download attempts')
+
+FLAGS = gflags.FLAGS
+
+
+class HostLimiter(object):
+  """Hands out a bounded number of connection slots per host."""
+
+  def __init__(self):
+    self.lock = thread.allocate_lock()
+    self.slots = {}
+
+  def slot(self, url):
+    """Get the semaphore guarding connections to the host of url.
+
+    Use it as a context manager around the request.
+    """
+    host = urlparse.urlparse(url)[1]
+    with self.lock:
+      if host not in self.slots:
+        self.slots[host] = threading.BoundedSemaphore(
+            FLAGS.connections_per_host)
+      return self.slots[host]
+
+
+LIMITER = HostLimiter()
+
+
+CHUNK_SIZE = 64 * 1024
+
+# Errors worth another download attempt: connection and socket errors
+# (socket.error is an IOError) and IncompleteDownload.
+RETRYABLE = (IOError,)
+
+
+def meta_path(path):
+  """Get the path of the validator file kept for a downloaded file."""
+  return path + '.meta'
+
+
+def load_meta(path):
+  """Load the validators stored for path.
+
+  Returns:
+     dictionary with 'url', 'etag', 'last_modified' and 'sha1' keys, empty
+     if nothing is stored.
+  """
+  try:
+    f = open(meta_path(path))
+    try:
+      return json.load(f)
+    finally:
+      f.close()
+  except (IOError, ValueError):
+    return {}
+
+
+def save_meta(path, meta):
+  tmp = meta_path(path) + '.tmp'
+  f = open(tmp, 'w')
+  try:
+    json.dump(meta, f)
+  finally:
+    f.close()
+  os.rename(tmp, meta_path(path))
+
+
+class IncompleteDownload(IOError):
+  """The server sent less than it announced, or a resume went wrong."""
+
+
+class HashingReader(object):
+  """File-like reader over a response that hashes everything read through
+  it, optionally copying it to another file as well.
+
+  When resuming, prefix is the partial file already on disk: its first
+  prefix_size bytes are read (and hashed, not copied) before the response.
+  """
+
+  def __init__(self, response, copy=None, prefix=None, prefix_size=0):
+    self.response = response
+    self.copy = copy
+    self.prefix = prefix
+    self.prefix_size = prefix_size
+    self.digest = hashlib.sha1()
+    # bytes read from the response itself
+    self.received = 0
+
+  def read(self, size=-1):
+    if self.prefix_size > 0:
+      if size < 0:
+        size = self.prefix_size
+      data = self.prefix.read(min(size, self.prefix_size))
+      if not data:
+        raise IncompleteDownload('partial download shrank')
+      self.prefix_size -= len(data)
+      self.digest.update(data)
+      return data
+    data = self.response.read(size)
+    self.digest.update(data)
+    self.received += len(data)
+    if self.copy is not None:
+      self.copy.write(data)
+    return data
+
+
+def discard_partial(path):
+  for name in (path + '.part', meta_path(path + '.part')):
+    if os.path.exists(name):
+      os.remove(name)
+
+
+def resume_offset(url, path):
+  """Get how much of url a previous attempt left in path's partial file.
+
+  A partial file is only resumed if its validators were stored, so the
+  server can tell (If-Range) whether it still has the same content.
+  """
+  tmp = path + '.part'
+  partial = load_meta(tmp)
+  if (partial.get('url') != url or
+      not (partial.get('etag') or partial.get('last_modified')) or
+      not os.path.exists(tmp)):
+    return 0, None
+  return os.path.getsize(tmp), partial.get('etag') or partial['last_modified']
+
+
+def fetch(url, path, conditional=True, consumer=None, keep=True,
+          resume=None):
+  """Download url to path, waiting for a free connection slot to its host.
+
+  If conditional is set and validators are stored for the same url, the
+  request carries If-None-Match/If-Modified-Since, and a 304 response leaves
+  path untouched.
+
+  With keep, the content is written to path.part and renamed into place
+  when complete. If an earlier attempt left a partial file, only the rest
+  is requested (Range/If-Range); a server that ignores the range just
+  sends everything again. A response shorter than its Content-Length
+  raises IncompleteDownload, also when the consumer failed on it first,
+  and leaves the partial file for the next attempt.
+
+  If consumer is given it is called with a file-like object reading the
+  content as it arrives (including any resumed part), so the content can be
+  processed while it downloads. Whatever it leaves unread is still read and
+  hashed. Without keep nothing but the validators is written, unless resume
+  asks for the partial file anyway; otherwise a retry streams from the
+  start again.
+
+  Args:
+     url: (string) URL to download
+     path: (string) file to write
+     conditional: (Boolean) allow a conditional request
+     consumer: (callable) reads the response while it downloads
+     keep: (Boolean) write the content to path
+     resume: (Boolean) keep a partial file to resume from, defaults to keep
+
+  Returns:
+     True if new content was written, False if the server answered 304 or
+     the downloaded content hashes the same as the previous download.
+  """
+  meta = load_meta(path)
+  tmp = path + '.part'
+  resume = keep or resume
+  request = urllib2.Request(url)
+  if conditional and meta.get('url') == url:
+    if meta.get('etag'):
+      request.add_header('If-None-Match', meta['etag'])
+    if meta.get('last_modified'):
+      request.add_header('If-Modified-Since', meta['last_modified'])
+  offset, validator = 0, None
+  if resume:
+    offset, validator = resume_offset(url, path)
+  if offset:
+    request.add_header('Range', 'bytes=%d-' % offset)
+    request.add_header('If-Range', validator)
+  with LIMITER.slot(url):
+    logging.debug('Downloading %s to %s' % (url, path))
+    try:
+      response = urllib2.urlopen(request)
+    except urllib2.HTTPError, e:
+      if e.code == 304:
+        logging.info('%s not modified' % url)
+        return False
+      if e.code == 416:
+        discard_partial(path)
+        raise IncompleteDownload('cannot resume %s at %d' % (url, offset))
+      raise
+    try:
+      info = response.info()
+      resumed = offset and response.getcode() == 206
+      if resumed:
+        expected = 'bytes %d-' % offset
+        if not (info.getheader('Content-Range') or '').startswith(expected):
+          discard_partial(path)
+          raise IncompleteDownload('bad range from %s: %s'
+                                   % (url, info.getheader('Content-Range')))
+        logging.info('Resuming %s at byte %d' % (url, offset))
+      prefix = out = None
+      if resumed:
+        prefix = open(tmp, 'rb')
+        out = open(tmp, 'ab')
+      elif resume:
+        out = open(tmp, 'wb')
+        save_meta(tmp, {'url': url, 'etag': info.getheader('ETag'),
+                        'last_modified': info.getheader('Last-Modified')})
+      reader = HashingReader(response, out, prefix, resumed and offset or 0)
+      length = info.getheader('Content-Length')
+
+      def check_complete():
+        if length is not None and reader.received < int(length):
+          raise IncompleteDownload('%s ended after %d of %s bytes'
+                                   % (url, reader.received, length))
+      try:
+        if consumer is not None:
+          try:
+            consumer(reader)
+          except IOError:
+            raise
+          except Exception:
+            # A consumer choking on a cut-off response is a retryable
+            # truncation, not bad content.
+            while reader.read(CHUNK_SIZE):
+              pass
+            check_complete()
+            raise
+        while reader.read(CHUNK_SIZE):
+          pass
+      finally:
+        if out is not None:
+          out.close()
+        if prefix is not None:
+          prefix.close()
+      check_complete()
+    finally:
+      response.close()
+  if keep:
+    os.rename(tmp, path)
+  discard_partial(path)
+  sha1 = reader.digest.hexdigest()
+  changed = not conditional or sha1 != meta.get('sha1')
+  save_meta(path, {'url': url,
+                   'etag': info.getheader('ETag'),
+                   'last_modified': info.getheader('Last-Modified'),
+                   'sha1': sha1})
+  if not changed:
+    logging.info('%s unchanged (sha1 %s)' % (url, sha1))
+  return changed
+
+
+def backoff(attempt, base, maximum):
+  """Seconds to wait before retry number attempt (from 0).
+
+  Exponential in attempt, capped at maximum, with full jitter so clients
+  that failed together do not retry together.
+  """
+  return random.uniform(0, min(maximum, base * 2 ** attempt))
+
+
+def retryable(error):
+  """Check whether a failed download is worth retrying."""
+  if isinstance(error, urllib2.HTTPError):
+    return error.code >= 500 or error.code in (408, 429)
+  return isinstance(error, RETRYABLE)
+
+
+def fetch_retrying(url, path, attempts=None, **kwargs):
+  """fetch(), retried with backoff on connection and server errors.
+
+  Args:
+     attempts: (int) tries before giving up, --download_attempts by default
+     other arguments as for fetch
+
+  Returns:
+     as fetch; the last error is raised if every attempt fails.
+  """
+  if attempts is None:
+    attempts = FLAGS.download_attempts
+  for attempt in range(attempts):
+    try:
+      return fetch(url, path, **kwargs)
+    except httplib.HTTPException, e:
+      # A connection dropped mid-response (IncompleteRead, BadStatusLine).
+      error = IncompleteDownload('%s: %s' % (url, e.__class__.__name__))
+    except RETRYABLE, e:
+      error = e
+    if attempt + 1 >= max(attempts, 1) or not retryable(error):
+      raise error
+    delay = backoff(attempt, FLAGS.download_backoff,
+                    FLAGS.download_backoff_max)
+    logging.warning('Download of %s failed (%s), retrying in %.1fs'
+                    % (url, error, delay))
+    time.sleep(delay)
@@ -0,0 +1,242 @@
+#!/usr/bin/python
+"""CCIS Crew Digital Display System Frontend/Client
+
+This module installs the fonts slides ship with into the user's font
+directory.
+
+Fonts are keyed by content hash, so a font already installed (by any slide)
+is never copied again, and a different font with the same file name gets a
+name of its own. A slide about to be parsed refreshes the fontconfig cache
+before its layout, on the loader thread; slides loading at the same time
+share one refresh. Other changes are batched into a single refresh, run on
+a timer thread shortly after the last one. Neither blocks the main loop. The store records which slides reference which font,
+and fonts it installed are removed once no slide references them.
+"""
+
+__author__ = 'CCIS Crew <crew@ccs.neu.edu>'
+
+
+import bundle
+import gflags
+import json
+import logging
+import os
+import shutil
+import subprocess
+import thread
+import threading
+
+gflags.DEFINE_string('font_directory', '~/.fonts',
+                     'Directory slide fonts are installed into')
+gflags.DEFINE_float('font_refresh_delay', 2.0,
+                    'Seconds to wait for more font installs before'
+                    ' refreshing the font cache')
+
+FLAGS = gflags.FLAGS
+
+INDEX = '.dds-fonts.js'
+
+
+class FontStore(object):
+  """Slide fonts installed in a font directory, deduplicated by hash."""
+
+  def __init__(self, directory, delay):
+    """
+    Args:
+       directory: (string) font directory
+       delay: (float) seconds to batch installs for before a cache refresh
+    """
+    self.directory = os.path.expanduser(directory)
+    self.delay = delay
+    self.lock = thread.allocate_lock()
+    # sha1 -> [file name, whether we installed it]
+    self.fonts = {}
+    # sha1 -> ids of the slides using the font
+    self.refs = {}
+    self.timer = None
+    # held while fc-cache runs, so concurrent refreshes do not overlap
+    self.refreshing = thread.allocate_lock()
+    # count of font changes, and how many of them the cache reflects
+    self.changes = 0
+    self.refreshed = 0
+    self.load()
+
+  def index_path(self):
+    return os.path.join(self.directory, INDEX)
+
+  def load(self):
+    try:
+      f = open(self.index_path())
+      try:
+        data = json.load(f)
+      finally:
+        f.close()
+    except (IOError, ValueError):
+      return
+    self.fonts = data.get('fonts', {})
+    self.refs = dict([(sha1, set(ids))
+                      for sha1, ids in data.get('refs', {}).iteritems()])
+
+  def save(self):
+    tmp = self.index_path() + '.tmp'
+    f = open(tmp, 'w')
+    try:
+      json.dump({'fonts': self.fonts,
+                 'refs': dict([(sha1, sorted(ids))
+                               for sha1, ids in self.refs.iteritems()])}, f)
+    finally:
+      f.close()
+    os.rename(tmp, self.index_path())
+
+  def installed(self, sha1):
+    """Check whether the font with this hash is present."""
+    entry = self.fonts.get(sha1)
+    return bool(entry) and os.path.isfile(os.path.join(self.directory,
+                                                       entry[0]))
+
+  def place(self, path, sha1):
+    """Put a font into the directory, unless identical content is there.
+
+    Returns:
+       True if the font was copied.
+    """
+    name = os.path.basename(path)
+    target = os.path.join(self.directory, name)
+    if os.path.exists(target):
+      if bundle.file_sha1(target) == sha1:
+        # Someone else's identical copy; use it but never remove it.
+        self.fonts[sha1] = [name, False]
+        return False
+      name = '%s-%s' % (sha1[:8], name)
+      target = os.path.join(self.directory, name)
+    tmp = target + '.tmp'
+    shutil.copyfile(path, tmp)
+    os.rename(tmp, target)
+    self.fonts[sha1] = [name, True]
+    return True
+
+  def install(self, slideid, paths, hashes=None, urgent=False):
+    """Install the fonts a slide uses and record that it uses them.
+
+    Args:
+       slideid: id of the slide
+       paths: (list) font files in the slide directory
+       hashes: (dictionary) known sha1 of some of the paths
+       urgent: (Boolean) the slide is about to be laid out, so refresh the
+               font cache before returning instead of batching the refresh
+
+    Returns:
+       number of fonts copied
+    """
+    hashes = hashes or {}
+    copied = 0
+    with self.lock:
+      if not os.path.isdir(self.directory):
+        os.makedirs(self.directory)
+      wanted = set()
+      for path in paths:
+        if not os.path.isfile(path):
+          logging.error('Font %s of slide %s does not exist' % (path, slideid))
+          continue
+        sha1 = hashes.get(path) or bundle.file_sha1(path)
+        wanted.add(sha1)
+        if not self.installed(sha1) and self.place(path, sha1):
+          copied += 1
+      self.set_refs(slideid, wanted)
+      self.save()
+      self.changes += bool(copied)
+      needed = self.changes
+    if copied:
+      logging.info('Installed %d fonts for slide %s' % (copied, slideid))
+      if urgent:
+        self.refresh(needed)
+      else:
+        self.schedule_refresh()
+    return copied
+
+  def set_refs(self, slideid, wanted):
+    for sha1 in self.refs.keys():
+      if sha1 not in wanted:
+        self.refs[sha1].discard(slideid)
+        if not self.refs[sha1]:
+          del self.refs[sha1]
+    for sha1 in wanted:
+      self.refs.setdefault(sha1, set()).add(slideid)
+
+  def release(self, slideid):
+    """Forget a removed slide's fonts and remove those no longer used.
+
+    Returns:
+       (list) file names of the fonts removed
+    """
+    removed = []
+    with self.lock:
+      self.set_refs(slideid, set())
+      for sha1, (name, owned) in self.fonts.items():
+        if sha1 in self.refs:
+          continue
+        del self.fonts[sha1]
+        path = os.path.join(self.directory, name)
+        if owned and os.path.isfile(path):
+          os.remove(path)
+          removed.append(name)
+      self.save()
+      self.changes += bool(removed)
+    if removed:
+      logging.info('Removed unused fonts %s' % removed)
+      self.schedule_refresh()
+    return removed
+
+  def schedule_refresh(self):
+    """Refresh the font cache once installs stop arriving for a while."""
+    with self.lock:
+      if self.timer is not None:
+        self.timer.cancel()
+      self.timer = threading.Timer(self.delay, self.refresh, [self.changes])
+      self.timer.setDaemon(True)
+      self.timer.start()
+
+  def refresh(self, needed=None):
+    """Bring the font cache up to date with the first needed changes.
+
+    Callers wait for a running refresh to finish. Any refresh that started
+    once those changes were made covers them, so concurrent callers share a
+    single fc-cache run.
+
+    Args:
+       needed: (int) value of self.changes to cover, all changes if None
+
+    Returns:
+       True if fc-cache ran, False if an earlier refresh already covered it
+    """
+    with self.refreshing:
+      with self.lock:
+        if needed is not None and self.refreshed >= needed:
+          return False
+        covered = self.changes
+        if self.timer is not None:
+          self.timer.cancel()
+          self.timer = None
+      self.rebuild()
+      self.refreshed = covered
+      return True
+
+  def rebuild(self):
+    """Rebuild the fontconfig cache of the font directory."""
+    try:
+      subprocess.call(['fc-cache', self.directory])
+    except OSError, e:
+      logging.warning('Could not refresh the font cache: %s' % e)
+
+
+_store = None
+_store_lock = thread.allocate_lock()
+
+
+def get_store():
+  """Get the store for --font_directory."""
+  global _store
+  with _store_lock:
+    if _store is None:
+      _store = FontStore(FLAGS.font_directory, FLAGS.font_refresh_delay)
+    return _store
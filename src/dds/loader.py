@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# vim: set shiftwidth=4 tabstop=4 softtabstop=4 :
+"""background slide loader
+"""
+
+import gflags
+import logging
+import thread
+import threading
+import time
+import Queue
+
+import slideobject
+
+FLAGS = gflags.FLAGS
+
+gflags.DEFINE_integer('loader_threads', 4,
+                      'Number of slides fetched and built in parallel')
+gflags.DEFINE_integer('failure_backoff', 60,
+                      'Seconds before a slide that failed to load is tried'
+                      ' again, doubling with each further failure')
+gflags.DEFINE_integer('failure_backoff_max', 3600,
+                      'Maximum seconds before a failed slide is tried again')
+
+
+class SlideLoader(object):
+    """Builds Slide objects from metadata on a pool of background threads.
+
+    Fetching, extracting and parsing a bundle is slow, so it happens here
+    rather than on the XMPP thread or the main loop. Each worker takes a
+    slide from download through parsing, so a bundle is extracted and
+    parsed as soon as it arrives. Downloads are further limited per host by
+    the download module. Requests for the same slide id that are still
+    waiting are coalesced into the newest one, and a slide is never built
+    by two workers at once. A slide that failed to load or parse is not
+    tried again with the same metadata until its backoff has passed, so a
+    broken bundle is not fetched again on every playlist push.
+    """
+    def __init__(self, callback):
+        """
+        Args:
+           callback: called as callback(metadata, slide) from the loader
+                     thread when a load finishes; slide is None on failure
+        """
+        self.callback = callback
+        self.pending = {}
+        # slide ids being built right now
+        self.active = set()
+        # slide id -> (modified, failure count, time of next try)
+        self.failures = {}
+        self.lock = thread.allocate_lock()
+        self.queue = Queue.Queue()
+        self.log = logging.getLogger('loader')
+        self.workers = []
+        for i in range(max(FLAGS.loader_threads, 1)):
+            worker = threading.Thread(target=self.run,
+                                      name='slideloader-%d' % i)
+            worker.setDaemon(True)
+            worker.start()
+            self.workers.append(worker)
+
+    def load(self, metadata, width, height, cached=False):
+        """Queue a slide to be built from metadata at the given stage size.
+
+        Args:
+           metadata: (dictionary) slide metadata
+           width, height: (int) stage size
+           cached: (Boolean) build from the bundle already on disk instead
+                   of fetching it
+        """
+        slideid = metadata['id']
+        with self.lock:
+            queued = slideid in self.pending
+            self.pending[slideid] = (metadata, width, height, cached)
+        if not queued:
+            self.queue.put(slideid)
+
+    def cancel(self, slideid):
+        """Drop a load that has not started yet."""
+        with self.lock:
+            self.pending.pop(slideid, None)
+
+    def run(self):
+        while True:
+            slideid = self.queue.get()
+            with self.lock:
+                if slideid in self.active:
+                    # Re-queued by the worker building it when it is done.
+                    continue
+                request = self.pending.pop(slideid, None)
+                if request is None:
+                    continue
+                self.active.add(slideid)
+            try:
+                self.build(slideid, *request)
+            finally:
+                with self.lock:
+                    self.active.discard(slideid)
+                    requeue = slideid in self.pending
+                if requeue:
+                    self.queue.put(slideid)
+
+    def build(self, slideid, metadata, width, height, cached):
+        if cached:
+            create = slideobject.Slide.create_slide_from_cache
+        else:
+            create = slideobject.Slide.create_slide_from_metadata
+        if not cached and self.backing_off(metadata):
+            self.callback(metadata, None)
+            return
+        try:
+            slide = create(metadata, width, height)
+        except Exception:
+            self.log.exception('Could not load slide %s' % slideid)
+            slide = None
+        if slide is None or not slide.group:
+            if slide is not None:
+                self.log.error('Slide %s did not parse' % slideid)
+            if not cached:
+                self.failed(metadata)
+        else:
+            with self.lock:
+                self.failures.pop(slideid, None)
+        self.callback(metadata, slide)
+
+    def backing_off(self, metadata):
+        """Check whether this version of a slide failed too recently."""
+        with self.lock:
+            failure = self.failures.get(metadata['id'])
+        if failure is None or failure[0] != metadata['modified']:
+            return False
+        wait = failure[2] - time.time()
+        if wait <= 0:
+            return False
+        self.log.info('Slide %s failed %d times, not trying again for %ds'
+                      % (metadata['id'], failure[1], wait))
+        return True
+
+    def failed(self, metadata):
+        """Record a failed load and when to try this version again."""
+        with self.lock:
+            failure = self.failures.get(metadata['id'])
+            count = 1
+            if failure is not None and failure[0] == metadata['modified']:
+                count = failure[1] + 1
+            delay = min(FLAGS.failure_backoff * 2 ** (count - 1),
+                        FLAGS.failure_backoff_max)
+            self.failures[metadata['id']] = (metadata['modified'], count,
+                                             time.time() + delay)
@@ -6,15 +6,28 @@
 import gflags
 import logging
 import thread
+import threading
 import gobject
-import clutter
 
 import collection
-import slideobject
+import commandqueue
+import fontstore
+import loader
+import screenshot
+import slidecache
+import slideindex
+import transition
 
 FLAGS = gflags.FLAGS
 
-gflags.DEFINE_boolean('transitions', True, 'Fade in and out slides')
+gflags.DEFINE_integer('prerender', 2,
+                      'Seconds before a transition to prepare the next slide'
+                      ' off-screen (0 disables)')
+gflags.DEFINE_boolean('warmstart', True,
+                      'Show cached slides from the slide index at startup')
+gflags.DEFINE_integer('memory_report_interval', 0,
+                      'Seconds between per-slide memory reports in the log'
+                      ' (0 disables)')
 
 class Manager(object):
     def __init__(self, stage):
@@ -23,132 +36,398 @@ class Manager(object):
         self.stage = stage
         self.log = logging.getLogger('manager')
         self.xmpphandler = None
-        self.setup_fade_to_black()
+        # All mutations from other threads go through here.
+        self.commands = commandqueue.CommandQueue()
+        self.loader = loader.SlideLoader(self.on_slide_loaded)
+        # slide id -> metadata of the load in flight for that slide
+        self.loading = {}
+        # on-disk record of the applied state, see warm_start
+        self.index = None
+        self.index_timer = None
+        self.transitions = transition.TransitionEngine(stage)
+        self.screenshots = screenshot.Screenshotter(
+            stage, self.onscreen_id,
+            lambda: self.transitions.running is not None)
         self.next_timer = None
-
-    def setup_fade_to_black(self):
-        self.blackfader = clutter.Rectangle()
-        self.blackfader.set_position(0,0)
-        self.blackfader.set_color(clutter.color_from_string("black"))
-        self.stage.add(self.blackfader)
+        self.prepare_timer = None
+        # next slide, warmed up off-screen ahead of its transition
+        self.prepared = None
+        # slide currently shown (or being transitioned to)
+        self.onscreen = None
+        # ids of the current and next slides, from the playlist lookahead
+        self.upcoming = []
+        self.slides.playlist.subscribe(self.on_lookahead)
+        # slide directories kept under --cache_quota, see manage_cache
+        self.cache = None
+        self.cache_sweeping = False
+        if FLAGS.memory_report_interval > 0:
+            gobject.timeout_add_seconds(FLAGS.memory_report_interval,
+                                        self.log_memory_report)
 
     def set_xmpp_handler(self, handler):
         self.xmpphandler = handler
 
+    def warm_start(self, path):
+        """Restore slides and playlist from the slide index at path.
+
+        Slides are rebuilt from the bundles already in the cache, without
+        contacting the server, and rotation starts as soon as the first one
+        is ready. When the server sends its playlist, set_playlist only
+        reloads what differs from the restored state. The index is kept up
+        to date from then on.
+
+        Args:
+           path: (string) slide index file
+        """
+        self.index = slideindex.SlideIndex(path)
+        if not FLAGS.warmstart or not self.index.load():
+            return
+        self.log.info('Warm start with %d cached slides'
+                      % len(self.index.slides))
+        width, height = self.stage.get_size()
+        for metadata in self.index.slides.values():
+            self.loading[metadata['id']] = metadata
+            self.loader.load(metadata, width, height, cached=True)
+        self.slides.playlist.replace(self.index.playlist)
+
+    def manage_cache(self, root):
+        """Keep the slide directories under root within --cache_quota.
+
+        Checks run every --cache_check_interval seconds, evicting on a
+        background thread.
+        """
+        if FLAGS.cache_quota <= 0:
+            return
+        self.cache = slidecache.SlideCache(root)
+        gobject.timeout_add_seconds(FLAGS.cache_check_interval,
+                                    self.check_cache)
+
+    def wanted_slides(self):
+        """Ids of slides whose cache directories must be kept."""
+        wanted = set(self.slides.id_list()) | set(self.loading)
+        wanted.update(self.upcoming)
+        if self.onscreen is not None:
+            wanted.add(self.onscreen.id())
+        return wanted
+
+    def check_cache(self):
+        """Measure the cache off the main loop, then evict on it."""
+        if self.cache_sweeping:
+            return True
+        self.cache_sweeping = True
+
+        def measure():
+            try:
+                entries = self.cache.entries()
+            except (IOError, OSError):
+                self.log.exception('Could not measure the slide cache')
+                self.cache_sweeping = False
+                return
+            gobject.idle_add(self.evict_cache, entries)
+
+        worker = threading.Thread(target=measure, name='cachemeasure')
+        worker.setDaemon(True)
+        worker.start()
+        return True
+
+    def evict_cache(self, entries):
+        """Evict slide directories over the quota.
+
+        Deciding and moving the directories aside both happen here on the
+        main loop, where loads are started, so no load can start on a
+        directory being evicted. Removing them happens on a thread.
+        """
+        wanted = set([str(slideid) for slideid in self.wanted_slides()])
+        try:
+            for name in self.cache.select(entries, FLAGS.cache_quota,
+                                          wanted):
+                self.cache.trash(name)
+        except (IOError, OSError):
+            self.log.exception('Could not evict from the slide cache')
+
+        def sweep():
+            try:
+                self.cache.empty_trash()
+                self.cache.save()
+            except (IOError, OSError):
+                self.log.exception('Could not clean up the slide cache')
+            self.cache_sweeping = False
+
+        worker = threading.Thread(target=sweep, name='cachesweep')
+        worker.setDaemon(True)
+        worker.start()
+        return False
+
+    def index_changed(self):
+        """Save the slide index soon, batching bursts of changes."""
+        if self.index is None or self.index_timer is not None:
+            return
+        self.index_timer = gobject.timeout_add(1000, self.save_index)
+
+    def save_index(self):
+        self.index_timer = None
+        try:
+            self.index.save()
+        except (IOError, OSError):
+            self.log.exception('Could not save slide index')
+        except (TypeError, ValueError):
+            # Metadata json cannot encode; the old index stays in place.
+            self.log.exception('Could not encode slide index')
+        return False
+
     def add_slide(self, metadata):
+        if self.index is not None:
+            self.index.set_slide(metadata)
+            self.index_changed()
         if self.slides.id_exists(metadata['id']):
             self.update_slide(metadata)
         else:
-            o = slideobject.Slide.create_slide_from_metadata(metadata,
-                                                      self.stage.get_width(),
-                                                      self.stage.get_height())
-            self._add_slide(o)
+            self.load_slide(metadata)
+
+    def load_slide(self, metadata):
+        """Start building a slide from metadata in the background.
+
+        The slide is added (or replaces the one with the same id) on the
+        main loop once it is ready; see on_slide_loaded.
+        """
+        loading = self.loading.get(metadata['id'])
+        if (loading is not None and
+            slideindex.comparable(loading['modified']) ==
+            slideindex.comparable(metadata['modified'])):
+            return
+        self.loading[metadata['id']] = metadata
+        width, height = self.stage.get_size()
+        self.loader.load(metadata, width, height)
+
+    def on_slide_loaded(self, metadata, slide):
+        """SlideLoader callback, runs on the loader thread."""
+        self.commands.put(None, self.slide_loaded, metadata, slide)
+
+    def slide_loaded(self, metadata, slide):
+        if self.loading.get(metadata['id']) is not metadata:
+            self.log.debug('Discarding stale load of slide %s'
+                           % metadata['id'])
+            if slide is not None:
+                self.destroy_slide(slide)
+            return
+        del self.loading[metadata['id']]
+        if slide is None:
+            return
+        old = self.slides.get_by_id(metadata['id'])
+        if old is not None:
+            self.slides.remove_slide(old)
+            if old.lock.locked():
+                old.defer('remove', lambda: self.destroy_slide(old))
+            else:
+                self.destroy_slide(old)
+        self._add_slide(slide)
 
     def _add_slide(self, o):
         self.log.debug('add_slide %s' % o)
         if not o.group:
             self.log.warning('Aborting _add_slide because the group is bad')
             return
-        wasempty = (self.slides.current_slide() is None)
         self.slides.add_slide(o)
-        if wasempty and self.slides.current_slide():
+        if self.onscreen is None and self.slides.current_slide():
             self.next(firsttime=True)
 
     def remove_slide(self, metadata):
         self.log.debug('remove_slide %s' % metadata)
+        if self.index is not None:
+            self.index.remove_slide(metadata)
+            self.index_changed()
+        if self.loading.pop(metadata, None) is not None:
+            self.loader.cancel(metadata)
         slide = self.slides.get_by_id(metadata)
         if slide:
             if slide.lock.locked():
-                sleeptime = 5000
                 self.log.warning('Cannot remove %s, currently on screen.'
-                                 ' Waiting %dms.' % (slide, sleeptime))
-                gobject.timeout_add(sleeptime,
-                                    lambda: self.remove_slide(metadata))
+                                 ' Removing once it is released.' % slide)
+                slide.defer('remove', lambda: self.remove_slide(metadata))
                 return
             with slide.lock:
                 self.slides.remove_slide(slide)
-                slide.group.destroy()
-                del slide
+                self.destroy_slide(slide)
+            fontstore.get_store().release(slide.id())
 
     def update_slide(self, metadata):
         self.log.debug('update_slide %s' % metadata)
+        if self.index is not None and metadata['id'] in self.index.slides:
+            self.index.set_slide(metadata)
+            self.index_changed()
         slide = self.slides.get_by_id(metadata['id'])
+        if slide:
+            # The server wants the slide (again); a removal deferred while
+            # it was on screen no longer applies. add_slide comes here too.
+            slide.cancel_deferred('remove')
         if slide and slide.needs_update(metadata):
-            self.slides.remove_slide(slide)
+            # The current slide keeps showing until its replacement is ready.
+            self.load_slide(metadata)
+
+    def destroy_slide(self, slide):
+        """Free everything held by a slide no longer in use."""
+        self.log.debug('Destroying %s' % slide)
+        slide.release_resources()
+
+    def memory_report(self):
+        """Get Slide.memory_report() for every slide, keyed by slide id."""
+        return dict([(slideid, self.slides.get_by_id(slideid).memory_report())
+                     for slideid in self.slides.id_list()])
+
+    def log_memory_report(self):
+        for slideid, report in sorted(self.memory_report().items()):
+            self.log.info('Memory for slide %s: %s' % (slideid, report))
+        return True
+
+    def set_playlist(self, packet):
+        """Apply a setPlaylist packet, touching only what changed.
+
+        Slides whose metadata is unchanged keep their parsed groups and
+        playlist items that are unchanged keep their rotation position.
+
+        Args:
+           packet: (dictionary) with 'slides' metadata and 'playlist' entries
+        """
+        added, updated, removed = self.slides.diff_slides(packet['slides'])
+        listed = set([metadata['id'] for metadata in packet['slides']])
+        removed.extend([slideid for slideid in self.loading
+                        if slideid not in listed and slideid not in removed])
+        self.log.info('set_playlist: %d added, %d updated, %d removed'
+                      % (len(added), len(updated), len(removed)))
+        for metadata in added:
             self.add_slide(metadata)
+        for metadata in updated:
+            self.update_slide(metadata)
+        self.slides.playlist.update(packet['playlist'])
+        for slideid in removed:
+            self.remove_slide(slideid)
+        if self.index is not None:
+            self.index.set_playlist(packet)
+            self.index_changed()
 
-    def after_transition(self, animation, slide):
-        self.stage.remove(slide.group)
-        gobject.timeout_add(1, slide.event_afterhide)
-        if self.slides.current_slide() != slide:
-            slide.lock.release()
+    def on_lookahead(self, window):
+        """Playlist lookahead subscriber.
+
+        Args:
+           window: (list) ids of the current slide and the ones after it
+        """
+        self.log.debug('Upcoming slides: %s' % window)
+        self.upcoming = window
+
+    def after_transition(self, outgoing, incoming):
+        """Finish a transition once the incoming slide is fully shown."""
+        self.retire_slide(outgoing, incoming)
         self.show_slide()
 
-    def show_slide(self):
-        gobject.timeout_add(1,
-            lambda:  self.fade_in_slide(self.slides.current_slide()))
-        self.next_timer = gobject.timeout_add(
-                            self.slides.current_slide().duration * 1000,
-                            self.next)
-
-    def fade_out_slide(self, slide, after):
-        slide.event_beforehide()
-        if FLAGS.transitions:
-            timeline = clutter.Timeline(500)
-            alpha = clutter.Alpha(timeline, clutter.LINEAR)
-            # FIXME this really shouldn't be here. We should set blackfader
-            # while initializing dds, but that's broken for some reason..
-            # This'll work for now.
-            self.blackfader.set_size(self.stage.get_width(),
-                                     self.stage.get_height())
-            self.blackfader.set_opacity(0)
-            self.fade_out_behavior = clutter.BehaviourOpacity(alpha=alpha,
-                                                              opacity_start=0,
-                                                              opacity_end=255)
-            self.fade_out_behavior.apply(self.blackfader)
-            self.blackfader.raise_top()
-            self.blackfader.show()
-            timeline.connect('completed', after, slide)
-            timeline.start()
-        else:
-            self.after_transition(None, slide)
+    def retire_slide(self, outgoing, incoming):
+        """Take the outgoing slide of a finished transition off the stage."""
+        if outgoing is not None and outgoing is not incoming:
+            self.stage.remove(outgoing.group)
+            outgoing.group.set_opacity(255)
+            gobject.timeout_add(1, outgoing.event_afterhide)
+            outgoing.release()
 
-    def fade_in_slide(self, slide):
-        self.stage.add(slide.group)
-        if FLAGS.transitions:
-            timeline = clutter.Timeline(500)
-            alpha = clutter.Alpha(timeline, clutter.LINEAR)
-            self.blackfader.raise_top()
-            self.blackfader.show()
-            self.blackfader.set_opacity(255)
-            self.fade_in_behavior = clutter.BehaviourOpacity(alpha=alpha,
-                                                             opacity_start=255,
-                                                             opacity_end=0)
-            self.fade_in_behavior.apply(self.blackfader)
-            timeline.start()
-        slide.group.show()
+    def onscreen_id(self):
+        if self.onscreen is None:
+            return None
+        return self.onscreen.id()
+
+    def show_slide(self):
+        slide = self.onscreen
         slide.start_event_loop()
         slide.event_aftershow()
+        slide.take_screenshot(self.screenshots)
+        if self.cache is not None:
+            self.cache.touch(slide.id())
         if self.xmpphandler is not None:
             self.xmpphandler.SetCurrentSlide(slide)
+        self.next_timer = gobject.timeout_add(slide.duration * 1000,
+                                              self.next)
+        if FLAGS.prerender > 0:
+            delay = max(slide.duration - FLAGS.prerender, 0)
+            self.prepare_timer = gobject.timeout_add(delay * 1000,
+                                                     self.prepare_next)
+
+    def prepare_next(self):
+        """Warm up the next slide before its transition starts.
+
+        Runs event_beforeshow and realizes the group on the stage, fully
+        transparent and below everything else, so its textures are uploaded
+        before the switch. The transition then only has to change opacity
+        and stacking. (Executed from a gobject timeout)
+        """
+        self.prepare_timer = None
+        window = self.slides.playlist.upcoming(2)
+        if len(window) < 2:
+            return False
+        slide = self.slides.get_by_id(window[1])
+        if (slide is None or slide is self.onscreen or
+            slide is self.prepared or not slide.group):
+            return False
+        self.release_prepared()
+        if not slide.lock.acquire(False):
+            self.log.debug('Not preparing %s, it is busy' % slide)
+            return False
+        self.log.debug('Preparing %s' % slide)
+        slide.event_beforeshow()
+        slide.group.set_opacity(0)
+        self.stage.add(slide.group)
+        slide.group.lower_bottom()
+        slide.group.show()
+        slide.group.realize()
+        self.prepared = slide
+        return False
+
+    def release_prepared(self):
+        """Take back a prepared slide that is not going to be shown next."""
+        slide = self.prepared
+        if slide is None:
+            return
+        self.prepared = None
+        self.log.debug('Releasing prepared %s' % slide)
+        self.stage.remove(slide.group)
+        slide.group.set_opacity(255)
+        if slide is not self.onscreen:
+            slide.release()
 
     def next(self, firsttime=False):
+        finished = self.transitions.finish()
+        if finished is not None:
+            # The slide that was fading in is skipped before it was shown:
+            # drop the outgoing slide but start nothing for this one.
+            self.retire_slide(*finished)
         if self.next_timer:
             if not gobject.source_remove(self.next_timer):
                 logging.error('Failed to remove "next" timer event!')
-        if firsttime:
-            self.slides.current_slide().lock.acquire()
-            self.slides.current_slide().event_beforeshow()
-            self.show_slide()
-        else:
-            last_slide = self.slides.current_slide()
+        self.next_timer = None
+        if self.prepare_timer:
+            gobject.source_remove(self.prepare_timer)
+            self.prepare_timer = None
+        last_slide = self.onscreen
+        if not firsttime:
             self.slides.advance()
-            if self.slides.current_slide() != last_slide:
-                self.slides.current_slide().lock.acquire()
-            self.slides.current_slide().event_beforeshow()
+        slide = self.slides.current_slide()
+        if slide is None:
+            if last_slide is not None:
+                # The playlist was swapped for one whose slides are not
+                # loaded yet. Keep what is on screen and try again later.
+                self.log.warning('No slide to advance to, retrying')
+                self.next_timer = gobject.timeout_add(1000, self.next)
+            return False
+        if slide is self.prepared:
+            # Already locked, and event_beforeshow has run.
+            self.prepared = None
+        else:
+            self.release_prepared()
+            if slide is not last_slide:
+                slide.lock.acquire()
+            slide.event_beforeshow()
+        self.onscreen = slide
+        if last_slide is not None:
             last_slide.stop_event_loop()
-            self.fade_out_slide(last_slide,
-                                self.after_transition)
+            last_slide.event_beforehide()
+        self.transitions.run(last_slide, slide, self.after_transition)
+        return False
 
     def resize_slide(self, slide):
         width, height = self.stage.get_size()
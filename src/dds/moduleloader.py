@@ -0,0 +1,378 @@
+#!/usr/bin/python
+"""CCIS Crew Digital Display System Frontend/Client
+
+This module loads the python code of module slides. Compiled code objects
+are cached in memory and on disk beside the extracted bundle, keyed by a
+hash of the source and the interpreter version, so parsing an unchanged
+slide again (or after a restart) does not recompile it.
+
+Slide modules are loaded without changing the working directory or
+sys.path. Each load gets its own package whose __path__ is the bundle
+directory, so a slide's `import helper` finds helper.py beside its
+layout.py through the normal (implicit relative) import machinery. Inside
+that package, `clutter.Texture` resolves relative file names against the
+bundle directory. The layout module's `open` and `file` do too; other
+modules of the package get the builtins, which resolve against the
+process working directory, so they should build paths from their
+__file__. Slides in different directories can therefore be loaded at the
+same time.
+
+The package's clutter and gobject modules also record the textures,
+timelines and event sources a slide creates, so everything can be released
+and the package unloaded when the slide is removed.
+"""
+
+__author__ = 'CCIS Crew <crew@ccs.neu.edu>'
+
+
+import hashlib
+import imp
+import itertools
+import logging
+import marshal
+import os
+import sys
+import thread
+import weakref
+
+PACKAGE_PREFIX = '_ddsslide_'
+
+# code cache key -> code object
+CODE_CACHE = {}
+CODE_CACHE_LOCK = thread.allocate_lock()
+
+
+def source_key(source):
+  """Get the cache key for some python source on this interpreter."""
+  return hashlib.sha1(imp.get_magic() + sys.version + source).hexdigest()
+
+
+def cache_path(path, key):
+  """Get the on-disk code cache file for source at path with key."""
+  directory, filename = os.path.split(path)
+  return os.path.join(directory, '.%s-%s.pyc' % (filename, key))
+
+
+def read_cache(cachefile):
+  """Load a code object from a cache file, or None if it is unusable."""
+  magic = imp.get_magic()
+  try:
+    f = open(cachefile, 'rb')
+    try:
+      data = f.read()
+    finally:
+      f.close()
+  except IOError:
+    return None
+  if data[:len(magic)] != magic:
+    return None
+  try:
+    return marshal.loads(data[len(magic):])
+  except (ValueError, EOFError, TypeError):
+    return None
+
+
+def write_cache(path, cachefile, code):
+  """Write a code cache file and remove stale ones for the same source."""
+  directory, filename = os.path.split(path)
+  prefix = '.%s-' % filename
+  for name in os.listdir(directory or '.'):
+    if (name.startswith(prefix) and name.endswith('.pyc') and
+        os.path.join(directory, name) != cachefile):
+      try:
+        os.remove(os.path.join(directory, name))
+      except OSError:
+        pass
+  tmp = '%s.%d.tmp' % (cachefile, os.getpid())
+  try:
+    f = open(tmp, 'wb')
+    try:
+      f.write(imp.get_magic())
+      marshal.dump(code, f)
+    finally:
+      f.close()
+    os.rename(tmp, cachefile)
+  except (IOError, OSError):
+    logging.exception('Could not write code cache %s' % cachefile)
+
+
+def compile_cached(path):
+  """Get the code object for the python source file at path.
+
+  Args:
+     path: (string) python source file
+
+  Returns:
+     code object, from the memory cache, the disk cache or a fresh compile
+  """
+  f = open(path, 'rb')
+  try:
+    source = f.read()
+  finally:
+    f.close()
+  key = source_key(source)
+  with CODE_CACHE_LOCK:
+    code = CODE_CACHE.get(key)
+  if code is not None:
+    return code
+  cachefile = cache_path(path, key)
+  code = read_cache(cachefile)
+  if code is None:
+    logging.debug('Compiling %s' % path)
+    code = compile(source.replace('\r\n', '\n'), path, 'exec')
+    write_cache(path, cachefile, code)
+  with CODE_CACHE_LOCK:
+    CODE_CACHE[key] = code
+  return code
+
+
+# distinguishes successive loads of the same directory
+LOAD_COUNTER = itertools.count()
+
+
+def resolver(directory):
+  """Get a function making relative file names relative to directory."""
+  def resolve(path):
+    if isinstance(path, basestring) and not os.path.isabs(path):
+      return os.path.join(directory, path)
+    return path
+  return resolve
+
+
+class SlideResources(object):
+  """What a slide module allocated through its clutter and gobject modules.
+
+  The slide package's clutter and gobject are stand-ins that record
+  created textures and timelines (weakly) and the ids of event sources
+  the module adds, so release() can stop and remove all of them.
+  """
+
+  def __init__(self):
+    self.sources = set()
+    self.textures = weakref.WeakValueDictionary()
+    self.timelines = weakref.WeakValueDictionary()
+    self.counter = itertools.count()
+
+  def add_texture(self, texture):
+    self.textures[self.counter.next()] = texture
+    return texture
+
+  def add_timeline(self, timeline):
+    self.timelines[self.counter.next()] = timeline
+    return timeline
+
+  def track_source(self, add, callback):
+    """Add an event source and remember its id while it lives.
+
+    Args:
+       add: function adding the source for a given callback, returning its id
+       callback: the source callback; the source ends when it returns False
+    """
+    box = []
+
+    def call(*callargs):
+      keep = callback(*callargs)
+      if not keep and box:
+        self.sources.discard(box[0])
+      return keep
+    sourceid = add(call)
+    box.append(sourceid)
+    self.sources.add(sourceid)
+    return sourceid
+
+  def release(self):
+    """Stop tracked timelines and remove tracked event sources."""
+    for timeline in self.timelines.values():
+      timeline.stop()
+    self.timelines.clear()
+    if self.sources:
+      import gobject
+      for sourceid in list(self.sources):
+        gobject.source_remove(sourceid)
+      self.sources.clear()
+    self.textures.clear()
+
+  def report(self):
+    return {'sources': len(self.sources),
+            'timelines': len(self.timelines),
+            'textures': len(self.textures)}
+
+
+def clutter_proxy(name, resolve, resources):
+  """Build a clutter module stand-in for a slide package.
+
+  Its Texture resolves file names with resolve, and Texture and Timeline
+  objects are recorded in resources. Both are subclasses of the clutter
+  classes, so slides can subclass them and use them in isinstance checks.
+
+  Returns:
+     module object, or None if clutter is not available
+  """
+  try:
+    import clutter
+  except ImportError:
+    return None
+  proxy = imp.new_module(name)
+  proxy.__dict__.update(clutter.__dict__)
+  proxy.__name__ = name
+
+  class Texture(clutter.Texture):
+    # A GType is registered per class; the module name keeps it unique.
+    __module__ = name
+
+    def __init__(self, filename=None, *args, **kwargs):
+      if filename is None:
+        clutter.Texture.__init__(self, *args, **kwargs)
+      else:
+        clutter.Texture.__init__(self, resolve(filename), *args, **kwargs)
+      resources.add_texture(self)
+
+  class Timeline(clutter.Timeline):
+    __module__ = name
+
+    def __init__(self, *args, **kwargs):
+      clutter.Timeline.__init__(self, *args, **kwargs)
+      resources.add_timeline(self)
+  proxy.Texture = Texture
+  proxy.Timeline = Timeline
+  return proxy
+
+
+def gobject_proxy(name, resources):
+  """Build a gobject module stand-in that records added event sources.
+
+  Returns:
+     module object, or None if gobject is not available
+  """
+  try:
+    import gobject
+  except ImportError:
+    return None
+  proxy = imp.new_module(name)
+  proxy.__dict__.update(gobject.__dict__)
+  proxy.__name__ = name
+
+  def timeout_add(interval, callback, *args, **kwargs):
+    return resources.track_source(
+        lambda call: gobject.timeout_add(interval, call, *args, **kwargs),
+        callback)
+
+  def timeout_add_seconds(interval, callback, *args, **kwargs):
+    return resources.track_source(
+        lambda call: gobject.timeout_add_seconds(interval, call, *args,
+                                                 **kwargs),
+        callback)
+
+  def idle_add(callback, *args, **kwargs):
+    return resources.track_source(
+        lambda call: gobject.idle_add(call, *args, **kwargs), callback)
+
+  def io_add_watch(fd, condition, callback, *args, **kwargs):
+    return resources.track_source(
+        lambda call: gobject.io_add_watch(fd, condition, call, *args,
+                                          **kwargs),
+        callback)
+
+  def source_remove(sourceid):
+    resources.sources.discard(sourceid)
+    return gobject.source_remove(sourceid)
+  proxy.timeout_add = timeout_add
+  proxy.timeout_add_seconds = timeout_add_seconds
+  proxy.idle_add = idle_add
+  proxy.io_add_watch = io_add_watch
+  proxy.source_remove = source_remove
+  return proxy
+
+
+def load_slide_module(codepath, directory, resources=None):
+  """Load a slide's python file as the module of a fresh slide package.
+
+  Args:
+     codepath: (string) file name of the module, relative to directory
+     directory: (string) bundle directory
+     resources: (SlideResources) where to record what the module allocates
+
+  Returns:
+     the module object; its __package__ names the package to pass to
+     unload_package once the slide is gone.
+  """
+  directory = os.path.abspath(directory)
+  if resources is None:
+    resources = SlideResources()
+  package_name = '%s%s_%d' % (PACKAGE_PREFIX,
+                              hashlib.sha1(directory).hexdigest()[:12],
+                              LOAD_COUNTER.next())
+  resolve = resolver(directory)
+  package = imp.new_module(package_name)
+  package.__path__ = [directory]
+  package.__file__ = os.path.join(directory, '__init__.py')
+  modulename = '%s.%s' % (package_name, os.path.splitext(codepath)[0])
+  module = imp.new_module(modulename)
+  module.__file__ = os.path.join(directory, codepath)
+  module.__package__ = package_name
+  module.open = lambda name, *args: open(resolve(name), *args)
+  module.file = lambda name, *args: file(resolve(name), *args)
+  code = compile_cached(module.__file__)
+  imp.acquire_lock()
+  try:
+    sys.modules[package_name] = package
+    for proxy in [clutter_proxy(package_name + '.clutter', resolve,
+                                resources),
+                  gobject_proxy(package_name + '.gobject', resources)]:
+      if proxy is not None:
+        sys.modules[proxy.__name__] = proxy
+    sys.modules[modulename] = module
+  finally:
+    imp.release_lock()
+  try:
+    exec code in module.__dict__
+  except:
+    resources.release()
+    unload_package(package_name)
+    raise
+  return module
+
+
+def unload_package(package_name):
+  """Remove a slide package and everything imported into it from sys.modules.
+
+  Once no package of the same bundle directory is left, the directory's
+  code objects are dropped from the memory cache as well.
+
+  Returns:
+     list of the removed module objects
+  """
+  prefix = package_name + '.'
+  imp.acquire_lock()
+  try:
+    package = sys.modules.get(package_name)
+    names = [name for name in sys.modules
+             if name == package_name or name.startswith(prefix)]
+    removed = [sys.modules.pop(name) for name in names]
+    directory = getattr(package, '__path__', [None])[0]
+    still_loaded = directory is not None and [
+        name for name, module in sys.modules.items()
+        if name.startswith(PACKAGE_PREFIX) and
+        getattr(module, '__path__', None) == [directory]]
+  finally:
+    imp.release_lock()
+  if directory is not None and not still_loaded:
+    forget_code(directory)
+  return removed
+
+
+def forget_code(directory):
+  """Drop the cached code objects of sources in directory from memory."""
+  prefix = os.path.join(directory, '')
+  with CODE_CACHE_LOCK:
+    for key, code in CODE_CACHE.items():
+      if code.co_filename.startswith(prefix):
+        del CODE_CACHE[key]
+
+
+def package_modules(package_name):
+  """Get the modules currently loaded into a slide package."""
+  prefix = package_name + '.'
+  return [module for name, module in sys.modules.items()
+          if module is not None and
+          (name == package_name or name.startswith(prefix))]
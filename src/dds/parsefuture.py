@@ -0,0 +1,72 @@
+#!/usr/bin/python
+"""CCIS Crew Digital Display System Frontend/Client
+
+This module hands the result of a slide parse from the main loop, where
+clutter objects have to be created, to the loader thread waiting for it.
+"""
+
+__author__ = 'CCIS Crew <crew@ccs.neu.edu>'
+
+
+import threading
+
+
+class ParseTimeout(Exception):
+  """The main loop did not finish parsing a slide in time."""
+
+
+class ParseFuture(object):
+  """Result of a parse run on the main loop, waited for on another thread.
+
+  A waiter that gives up cancels the future, so a parse finishing late can
+  tell its result is no longer wanted.
+  """
+
+  def __init__(self):
+    self.done = threading.Event()
+    self.lock = threading.Lock()
+    self.cancelled = False
+    self.result = None
+    self.error = None
+
+  def resolve(self, result=None, error=None):
+    """Resolve the future unless it was cancelled.
+
+    Returns:
+       True if the result was delivered, False if nobody waits for it.
+    """
+    with self.lock:
+      if self.cancelled:
+        return False
+      self.result = result
+      self.error = error
+      self.done.set()
+      return True
+
+  def set_result(self, result):
+    return self.resolve(result=result)
+
+  def set_exception(self, error):
+    return self.resolve(error=error)
+
+  def cancel(self):
+    """Stop waiting; returns False if the future was resolved already."""
+    with self.lock:
+      if self.done.isSet():
+        return False
+      self.cancelled = True
+      return True
+
+  def wait(self, timeout):
+    """Block until resolved, then return the result or raise the exception.
+
+    Raises:
+       ParseTimeout if nothing resolved the future within timeout seconds;
+       the future is cancelled then.
+    """
+    self.done.wait(timeout)
+    if not self.done.isSet() and self.cancel():
+      raise ParseTimeout('no parse result after %ss' % timeout)
+    if self.error is not None:
+      raise self.error
+    return self.result
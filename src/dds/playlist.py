@@ -3,6 +3,7 @@
 """slide playlist
 """
 
+import collections
 import gflags
 import logging
 import thread
@@ -10,16 +11,15 @@ import random
 
 FLAGS = gflags.FLAGS
 
+gflags.DEFINE_integer('lookahead', 3,
+                      'Number of upcoming slides announced to subscribers')
+
 class SlideItem(object):
     def __init__(self, position, ids, weights, mode):
         self.position = position
         self.ids = ids
         self.weights = weights
         self.mode = mode
-        if not self.ids:
-            self.choicelist = self.ids
-        else:
-            self.choicelist = None
 
     def safepick(self, l):
         if l and len(l) > 1:
@@ -42,46 +42,204 @@ class RandomSlideItem(SlideItem):
         return self.safepick(self.ids)
 
 class WeightedSlideItem(SlideItem):
-    def buildchoicelist(self):
-        if self.choicelist is None:
-            self.choicelist = []
-            for x in range(len(self.ids)):
-                idval = [self.ids[x]]*self.weights[x]
-                self.choicelist.extend(idval)
+    def __init__(self, position, ids, weights, mode):
+        SlideItem.__init__(self, position, ids, weights, mode)
+        self.aliastable = None
+
+    def buildaliastable(self):
+        """Build a Walker/Vose alias table from self.ids and self.weights.
+
+        The table is a tuple of (ids, probability, alias) lists, one entry
+        per slide with a positive weight, so it costs O(n) to build no
+        matter how large the weights are. Weights may be fractional.
+        """
+        if self.aliastable is not None:
+            return
+        pairs = [(i, float(w)) for i, w in zip(self.ids, self.weights)
+                 if w > 0]
+        ids = [i for i, unused_w in pairs]
+        count = len(pairs)
+        total = sum([w for unused_i, w in pairs])
+        probability = [1.0] * count
+        alias = range(count)
+        scaled = [w * count / total for unused_i, w in pairs]
+        small = [x for x in range(count) if scaled[x] < 1.0]
+        large = [x for x in range(count) if scaled[x] >= 1.0]
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+            probability[less] = scaled[less]
+            alias[less] = more
+            scaled[more] = (scaled[more] + scaled[less]) - 1.0
+            if scaled[more] < 1.0:
+                small.append(more)
+            else:
+                large.append(more)
+        # Anything left over is 1.0 up to rounding error.
+        self.aliastable = (ids, probability, alias)
 
     def slide(self):
-        self.buildchoicelist()
-        return self.safepick(self.choicelist)
+        self.buildaliastable()
+        ids, probability, alias = self.aliastable
+        if not ids:
+            return None
+        column = random.randrange(len(ids))
+        if random.random() < probability[column]:
+            return ids[column]
+        return ids[alias[column]]
 
-class Playlist(object):
+class SlideRing(object):
+    """Playlist items in fixed storage with a cursor marking the head.
+
+    Rotating moves the cursor instead of reordering storage, so advancing
+    and rewinding are constant time. Iteration, indexing and comparison
+    see the items in rotated order, starting at the cursor.
+
+    Slide picks are drawn ahead of time into schedule, whose first entry
+    is the pick for the head item and each following entry the pick for the
+    next item in rotation. Advancing consumes one pick; rewinding discards
+    the schedule since the picks no longer line up.
+    """
+    def __init__(self, items=None):
+        self.storage = list(items or [])
+        self.cursor = 0
+        self.schedule = collections.deque()
+
+    def __len__(self):
+        return len(self.storage)
+
+    def __iter__(self):
+        storage, cursor = self.storage, self.cursor
+        for i in xrange(len(storage)):
+            yield storage[(cursor + i) % len(storage)]
+
+    def __getitem__(self, index):
+        storage = self.storage
+        if not -len(storage) <= index < len(storage):
+            raise IndexError('ring index out of range')
+        return storage[(self.cursor + index) % len(storage)]
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def append(self, item):
+        """Add an item at the tail of the rotation (just before the head)."""
+        if self.cursor:
+            self.storage.insert(self.cursor, item)
+            self.cursor += 1
+        else:
+            self.storage.append(item)
+
+    def rotate(self, steps=1):
+        if self.storage:
+            self.cursor = (self.cursor + steps) % len(self.storage)
+        if steps == 1 and self.schedule:
+            self.schedule.popleft()
+        else:
+            self.schedule.clear()
+
+    def resolve(self, count):
+        """Return the slide ids picked for the next count items.
+
+        Picks not drawn yet are drawn now and kept, so later calls and the
+        rotation itself see the same ids.
+        """
+        storage = self.storage
+        if not storage:
+            return []
+        schedule = self.schedule
+        while len(schedule) < count:
+            index = (self.cursor + len(schedule)) % len(storage)
+            schedule.append(storage[index].slide())
+        return list(schedule)[:count]
+
+    def head(self):
+        """Return the item under the cursor, or None if the ring is empty."""
+        storage = self.storage
+        if storage:
+            return storage[self.cursor % len(storage)]
+        return None
+
+class PlaylistDiff(object):
+    """Difference between the published playlist and incoming entries.
+
+    items is the complete list of SlideItems for the new playlist, reusing
+    the old objects for entries that did not change. The other attributes
+    record what changed, for logging and for deciding whether to publish.
+    """
     def __init__(self):
         self.items = []
+        self.inserted = []
+        self.removed = []
+        self.reweighted = []
+        self.reordered = False
+
+    def changed(self):
+        return bool(self.inserted or self.removed or self.reweighted or
+                    self.reordered)
+
+    def __str__(self):
+        return ('PLDiff(inserted:%d, removed:%d, reweighted:%d, reordered:%s)'
+                % (len(self.inserted), len(self.removed),
+                   len(self.reweighted), self.reordered))
+
+class Playlist(object):
+    """The rotation of slide items.
+
+    Rotating and reading the upcoming ids (which draws the random picks
+    into the ring's schedule) only happen on the main loop, where the
+    command queue also applies playlist changes; so readers never take
+    the lock. The lock only keeps writers from interleaving with each
+    other.
+    """
+    def __init__(self):
+        self.items = SlideRing()
         self.lock = thread.allocate_lock()
         self.log = logging.getLogger('playlist')
-        self.currentid = None
+        self.subscribers = []
+
+    def subscribe(self, callback):
+        """Call callback with the upcoming slide ids whenever they change.
+
+        The callback receives the list returned by upcoming(FLAGS.lookahead)
+        after every rotation and every published playlist change, on
+        whichever thread made the change (the main loop, in the frontend).
+        """
+        self.subscribers.append(callback)
+
+    def notify(self):
+        if not self.subscribers:
+            return
+        window = self.upcoming(FLAGS.lookahead)
+        for callback in self.subscribers:
+            try:
+                callback(window)
+            except Exception:
+                self.log.exception('Lookahead subscriber %s failed'
+                                   % callback)
 
     def empty(self):
         self.log.debug('Checking if empty')
-        with self.lock:
-            return not bool(self.items)
+        return not self.items
 
     def has_multiple(self):
         self.log.debug('Checking has multiple')
-        with self.lock:
-            return len(self.items) > 1
+        return len(self.items) > 1
 
     def rotate(self, direction='forward'):
-        if self.empty():
-            return
-        logging.info('playlist rotation')
-        with self.lock:
-            logging.info('playlist rotation: %s' % direction)
-            if direction == 'forward':
-                self.items.append(self.items.pop(0))
-            else:
-                self.items.insert(0, self.items.pop())
-        self.log.debug('Playlist: %s' % str(self.items))
-        self.currentid = None
+        if direction == 'forward':
+            self.items.rotate(1)
+        else:
+            self.items.rotate(-1)
+        self.log.debug('playlist rotation: %s, cursor %d'
+                       % (direction, self.items.cursor))
+        self.notify()
     
     def advance(self):
         self.rotate(direction='forward')
@@ -90,19 +248,138 @@ class Playlist(object):
         self.rotate(direction='reverse')
 
     def purge(self):
-        self.items = []
+        self.items = SlideRing()
 
     def current_slide(self):
-        if self.currentid is None:
-            self.currentid = self.items[0].slide()
-            self.log.debug('Playlist picked %d' % self.currentid)
-            self.log.debug('Playlist: %s' % str(self.items))
-        return self.currentid
+        """Return the slide id at the head of the playlist, or None.
 
-    def add(self, itm):
+        Never takes the lock: self.items is only ever replaced wholesale, so
+        reading it once gives a consistent ring.
+        """
+        picks = self.items.resolve(1)
+        if not picks:
+            return None
+        return picks[0]
+
+    def upcoming(self, count):
+        """Return the next count slide ids, starting with the current one.
+
+        Random and weighted items are picked now and the picks are kept, so
+        the slides shown later are the ones returned here (unless the
+        playlist is rewound or replaced first).
+
+        Args:
+           count: (int) number of slide ids to return
+
+        Returns:
+           list of slide ids, empty if the playlist is empty
+        """
+        return self.items.resolve(count)
+
+    @staticmethod
+    def make_item(itm):
+        """Create a SlideItem from a playlist entry dictionary."""
         plclass = {'single':SlideItem, 'random':RandomSlideItem,
                    'weighted':WeightedSlideItem}
-        item = plclass[itm['mode']](itm['position'], itm['slides'],
+        return plclass[itm['mode']](itm['position'], itm['slides'],
                                     itm['weights'], itm['mode'])
+
+    def add(self, itm):
+        item = self.make_item(itm)
         with self.lock:
             self.items.append(item)
+
+    def replace(self, itms):
+        """Build a new playlist from entry dictionaries and publish it.
+
+        The new ring is built completely before a single reference swap, so
+        readers see either the old playlist or the new one, never a partial
+        one.
+
+        Args:
+           itms: (list) playlist entry dictionaries
+        """
+        ring = SlideRing([self.make_item(itm) for itm in itms])
+        with self.lock:
+            self.items = ring
+        self.log.debug('Playlist replaced with %d items' % len(ring))
+        self.notify()
+
+    @staticmethod
+    def item_key(mode, ids):
+        return (mode, tuple(ids))
+
+    def diff(self, itms):
+        """Compare playlist entry dictionaries against the current playlist.
+
+        Entries are matched to existing items by mode and slide ids. A match
+        with the same weights reuses the existing item (and its alias
+        table); a match with different weights counts as reweighted.
+
+        Args:
+           itms: (list) playlist entry dictionaries
+
+        Returns:
+           PlaylistDiff
+        """
+        old = self.items.storage
+        unused = {}
+        for index, item in enumerate(old):
+            key = self.item_key(item.mode, item.ids)
+            unused.setdefault(key, []).append(index)
+        diff = PlaylistDiff()
+        lastindex = -1
+        for itm in itms:
+            candidates = unused.get(self.item_key(itm['mode'], itm['slides']))
+            if not candidates:
+                item = self.make_item(itm)
+                diff.inserted.append(item)
+            else:
+                index = candidates.pop(0)
+                if index < lastindex:
+                    diff.reordered = True
+                lastindex = index
+                if list(old[index].weights) == list(itm['weights']):
+                    item = old[index]
+                    item.position = itm['position']
+                else:
+                    item = self.make_item(itm)
+                    diff.reweighted.append(item)
+            diff.items.append(item)
+        for indexes in unused.itervalues():
+            diff.removed.extend([old[index] for index in indexes])
+        return diff
+
+    def update(self, itms):
+        """Apply only what changed in the given playlist entries.
+
+        Unchanged items are carried over as-is and the rotation stays on the
+        item that was at the head, if it survived the update. The new ring
+        is published with a single reference swap, as in replace.
+
+        Args:
+           itms: (list) playlist entry dictionaries
+
+        Returns:
+           PlaylistDiff describing the applied changes
+        """
+        with self.lock:
+            diff = self.diff(itms)
+            if not diff.changed():
+                self.log.debug('Playlist unchanged')
+                return diff
+            old = self.items
+            ring = SlideRing(diff.items)
+            head = old.head()
+            for index, item in enumerate(ring.storage):
+                if item is head:
+                    ring.cursor = index
+                    ring.schedule.extend(list(old.schedule)[:1])
+                    break
+            else:
+                if ring.storage:
+                    ring.cursor = min(old.cursor, len(ring.storage) - 1)
+            self.items = ring
+        self.log.info('Playlist updated: %s' % diff)
+        self.notify()
+        return diff
@@ -0,0 +1,380 @@
+#!/usr/bin/python
+"""CCIS Crew Digital Display System Frontend/Client
+
+This module runs module slides in a separate worker process.
+
+The worker loads the slide's layout.py, puts its group on an off-screen
+stage and copies the rendered pixels into a shared memory buffer. The
+frontend shows that buffer as a texture and forwards the slide's event
+hooks to the worker, so slow or stuck slide code cannot freeze the main
+loop. Every hook runs under a CPU-time budget in the worker and a
+wall-time budget enforced by the frontend; a worker that blows its wall
+budget is killed and started again for the next hook.
+
+Running this file as a script starts a worker; see worker_main.
+"""
+
+__author__ = 'CCIS Crew <crew@ccs.neu.edu>'
+
+
+import gflags
+import json
+import logging
+import mmap
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+gflags.DEFINE_boolean('sandbox_modules', False,
+                      'Run module slides in worker processes')
+gflags.DEFINE_float('sandbox_cpu_budget', 1.0,
+                    'CPU seconds a sandboxed slide hook may use')
+gflags.DEFINE_integer('sandbox_wall_budget', 5000,
+                      'Milliseconds a sandboxed slide hook may take before'
+                      ' its worker is killed')
+gflags.DEFINE_integer('sandbox_frame_interval', 100,
+                      'Milliseconds between frames copied from a visible'
+                      ' sandboxed slide')
+gflags.DEFINE_integer('sandbox_restarts', 3,
+                      'Times a failed sandbox worker is started again')
+
+FLAGS = gflags.FLAGS
+
+HOOKS = ['beforeshow', 'aftershow', 'beforehide', 'afterhide', 'loop']
+
+# Frames are double buffered: the worker alternates between two slots, so
+# the slot named in a frame message is not rewritten until the next one.
+SLOTS = 2
+
+
+def shm_directory():
+  """Directory for shared frame buffers, memory backed where possible."""
+  if os.path.isdir('/dev/shm'):
+    return '/dev/shm'
+  return None
+
+
+class LineReader(object):
+  """Splits data read from a pipe into JSON messages, one per line."""
+
+  def __init__(self):
+    self.buffer = ''
+
+  def feed(self, data):
+    """Add data and return the complete messages it finished."""
+    self.buffer += data
+    messages = []
+    while '\n' in self.buffer:
+      line, self.buffer = self.buffer.split('\n', 1)
+      if line.strip():
+        messages.append(json.loads(line))
+    return messages
+
+
+class SandboxClient(object):
+  """Frontend side of a sandboxed module slide.
+
+  Stands in for the slide module's app object: it has the event_* hooks
+  and event_loop, which are forwarded to the worker, and group, a clutter
+  group holding the texture the worker's frames are shown in.
+
+  The worker is only started by the first hook, and only sends frames
+  while the slide is visible, from beforeshow (which runs when the slide
+  is prepared) until afterhide. A worker that dies or is killed for
+  exceeding its wall budget is started again by the next hook, at most
+  --sandbox_restarts times; after that the slide keeps its last frame.
+  """
+
+  def __init__(self, directory, codepath, width, height):
+    import clutter
+    import gobject
+    self.gobject = gobject
+    self.log = logging.getLogger('sandbox')
+    self.directory = os.path.abspath(directory)
+    self.codepath = codepath
+    self.width = width
+    self.height = height
+    self.framesize = width * height * 4
+    self.shmpath = None
+    self.buffer = None
+    self.texture = clutter.Texture()
+    self.texture.set_size(width, height)
+    self.group = clutter.Group()
+    self.group.add(self.texture)
+    self.flags = clutter.TextureFlags(0)
+    self.process = None
+    self.watch = None
+    self.reader = None
+    self.requests = {}
+    self.counter = 0
+    # times the worker had to be started again
+    self.restarts = 0
+    self.visible = False
+    self.closed = False
+
+  def start(self):
+    """Start the worker process."""
+    if self.buffer is None:
+      fd, self.shmpath = tempfile.mkstemp(prefix='dds-sandbox-',
+                                          dir=shm_directory())
+      os.ftruncate(fd, self.framesize * SLOTS)
+      self.buffer = mmap.mmap(fd, self.framesize * SLOTS)
+      os.close(fd)
+    args = {'directory': self.directory, 'codepath': self.codepath,
+            'width': self.width, 'height': self.height, 'shm': self.shmpath,
+            'cpu_budget': FLAGS.sandbox_cpu_budget,
+            'frame_interval': FLAGS.sandbox_frame_interval,
+            'visible': self.visible}
+    self.log.debug('Starting sandbox worker for %s' % self.codepath)
+    self.process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__.replace('.pyc', '.py')),
+         json.dumps(args)],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, close_fds=True)
+    self.reader = LineReader()
+    self.watch = self.gobject.io_add_watch(
+        self.process.stdout,
+        self.gobject.IO_IN | self.gobject.IO_HUP | self.gobject.IO_ERR,
+        self.on_output)
+
+  def running(self):
+    """Make sure a worker is running, starting one if allowed.
+
+    Returns:
+       True if there is a worker to talk to.
+    """
+    if self.closed:
+      return False
+    if self.process is None:
+      if self.restarts > FLAGS.sandbox_restarts:
+        return False
+      self.start()
+    return True
+
+  def request(self, hook):
+    """Ask the worker to run a hook, under the wall-time budget."""
+    if not self.running():
+      return
+    self.counter += 1
+    timer = self.gobject.timeout_add(FLAGS.sandbox_wall_budget,
+                                     self.on_timeout, self.counter, hook)
+    self.requests[self.counter] = (timer, time.time())
+    try:
+      self.process.stdin.write(json.dumps({'id': self.counter,
+                                           'hook': hook}) + '\n')
+      self.process.stdin.flush()
+    except IOError:
+      self.log.error('Sandbox worker for %s is gone' % self.codepath)
+      self.stop(failed=True)
+
+  def event_beforeshow(self):
+    self.visible = True
+    self.request('beforeshow')
+
+  def event_aftershow(self):
+    self.request('aftershow')
+
+  def event_beforehide(self):
+    self.request('beforehide')
+
+  def event_afterhide(self):
+    self.request('afterhide')
+    self.visible = False
+
+  def event_loop(self):
+    self.request('loop')
+
+  def on_output(self, source, condition):
+    """Handle worker messages. (Executed from a gobject io watch)"""
+    data = ''
+    if condition & self.gobject.IO_IN:
+      data = os.read(source.fileno(), 65536)
+    if not data:
+      self.log.warning('Sandbox worker for %s exited' % self.codepath)
+      self.watch = None
+      self.stop(failed=True)
+      return False
+    for message in self.reader.feed(data):
+      self.handle(message)
+    return True
+
+  def handle(self, message):
+    if 'frame' in message:
+      if not self.visible:
+        return
+      start = message['frame'] * self.framesize
+      self.texture.set_from_rgb_data(
+          self.buffer[start:start + self.framesize], True, self.width,
+          self.height, self.width * 4, 4, self.flags)
+    elif 'id' in message:
+      timer, started = self.requests.pop(message['id'], (None, None))
+      if timer is None:
+        return
+      self.gobject.source_remove(timer)
+      if not message.get('ok'):
+        self.log.warning('Sandboxed hook failed: %s' % message.get('error'))
+      self.log.debug('Sandboxed hook %s took %.3fs wall, %.3fs cpu'
+                     % (message.get('hook'), time.time() - started,
+                        message.get('cpu', 0)))
+    elif 'error' in message:
+      self.log.error('Sandbox worker error: %s' % message['error'])
+
+  def on_timeout(self, requestid, hook):
+    """A hook ran past the wall budget: kill the worker."""
+    self.requests.pop(requestid, None)
+    self.log.error('Sandboxed %s exceeded %dms, killing worker'
+                   % (hook, FLAGS.sandbox_wall_budget))
+    self.stop(failed=True)
+    return False
+
+  def stop(self, failed=False):
+    """Stop the worker, if any. A failed one counts towards the restarts."""
+    if self.process is None:
+      return
+    if failed:
+      self.restarts += 1
+    for timer, unused_started in self.requests.values():
+      self.gobject.source_remove(timer)
+    self.requests = {}
+    if self.watch is not None:
+      self.gobject.source_remove(self.watch)
+      self.watch = None
+    if self.process.poll() is None:
+      try:
+        os.kill(self.process.pid, signal.SIGKILL)
+      except OSError:
+        pass
+    self.process.wait()
+    self.process = None
+
+  def close(self):
+    """Stop the worker for good and free the shared buffer."""
+    if self.closed:
+      return
+    self.closed = True
+    self.stop()
+    if self.buffer is not None:
+      self.buffer.close()
+      self.buffer = None
+      try:
+        os.remove(self.shmpath)
+      except OSError:
+        pass
+
+
+class BudgetExceeded(Exception):
+  """A hook used more CPU time than it was allowed."""
+
+
+def on_cpu_budget(unused_signum, unused_frame):
+  raise BudgetExceeded('cpu budget exceeded')
+
+
+def run_budgeted(func, budget):
+  """Run func with a CPU-time limit, returning the CPU seconds it used."""
+  start = sum(os.times()[:2])
+  signal.setitimer(signal.ITIMER_PROF, budget)
+  try:
+    func()
+  finally:
+    signal.setitimer(signal.ITIMER_PROF, 0)
+  return sum(os.times()[:2]) - start
+
+
+def worker_main(args):
+  """Run a sandbox worker.
+
+  Args:
+     args: (dictionary) directory, codepath, width, height, shm,
+           cpu_budget, frame_interval and visible, as sent by SandboxClient
+  """
+  import clutter
+  import gobject
+  import moduleloader
+
+  # Keep the real stdout for messages; anything the slide prints goes to
+  # stderr instead of corrupting them.
+  out = os.fdopen(os.dup(1), 'w')
+  os.dup2(2, 1)
+  sys.stdout = sys.stderr
+
+  def send(message):
+    out.write(json.dumps(message) + '\n')
+    out.flush()
+
+  signal.signal(signal.SIGPROF, on_cpu_budget)
+  width, height = args['width'], args['height']
+  framesize = width * height * 4
+  shmfile = open(args['shm'], 'r+b')
+  buffer = mmap.mmap(shmfile.fileno(), framesize * SLOTS)
+  stage = clutter.Stage()
+  stage.set_property('offscreen', True)
+  stage.set_size(width, height)
+  stage.set_color(clutter.color_from_string('black'))
+  holder = {}
+
+  def load():
+    holder['module'] = moduleloader.load_slide_module(args['codepath'],
+                                                      args['directory'])
+  try:
+    run_budgeted(load, args['cpu_budget'])
+  except Exception, e:
+    send({'error': 'could not load %s: %s' % (args['codepath'], e)})
+    return 1
+  module = holder['module']
+  stage.add(module.slide)
+  stage.show_all()
+  state = {'slot': 0, 'timer': None}
+
+  def capture():
+    data = stage.read_pixels(0, 0, width, height)
+    if data:
+      start = state['slot'] * framesize
+      buffer[start:start + len(data)] = data
+      send({'frame': state['slot']})
+      state['slot'] = (state['slot'] + 1) % SLOTS
+    return True
+
+  def set_visible(visible):
+    """Send frames only while the slide can be seen."""
+    if visible and state['timer'] is None:
+      state['timer'] = gobject.timeout_add(args['frame_interval'], capture)
+    elif not visible and state['timer'] is not None:
+      gobject.source_remove(state['timer'])
+      state['timer'] = None
+
+  reader = LineReader()
+
+  def on_input(source, condition):
+    data = os.read(source.fileno(), 65536)
+    if not data:
+      clutter.main_quit()
+      return False
+    for message in reader.feed(data):
+      hook = getattr(module.app, 'event_%s' % message['hook'], None)
+      reply = {'id': message['id'], 'hook': message['hook'], 'ok': True}
+      if hook is not None:
+        try:
+          reply['cpu'] = run_budgeted(hook, args['cpu_budget'])
+        except Exception, e:
+          reply['ok'] = False
+          reply['error'] = '%s: %s' % (e.__class__.__name__, e)
+      send(reply)
+      if message['hook'] == 'beforeshow':
+        set_visible(True)
+      elif message['hook'] == 'afterhide':
+        set_visible(False)
+      if state['timer'] is not None:
+        capture()
+    return True
+
+  gobject.io_add_watch(sys.stdin, gobject.IO_IN | gobject.IO_HUP, on_input)
+  set_visible(args['visible'])
+  clutter.main()
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(worker_main(json.loads(sys.argv[1])))
@@ -0,0 +1,162 @@
+#!/usr/bin/python
+"""CCIS Crew Digital Display System Frontend/Client
+
+This module captures screenshots of the stage in-process.
+
+Pixels are read from the stage on the main loop, which is all the main
+loop pays for; scaling down to a thumbnail and PNG/JPEG encoding happen on
+a worker thread. Requests are rate limited: within --screenshot_interval
+of the last capture, requests are answered with that capture, and
+requests arriving while a capture is in flight share its result, so
+monitoring polls cannot slow down playback.
+"""
+
+__author__ = 'CCIS Crew <crew@ccs.neu.edu>'
+
+
+import gflags
+import gobject
+import gtk.gdk
+import logging
+import thread
+import threading
+import time
+
+gflags.DEFINE_integer('screenshot_width', 320,
+                      'Width of screenshot thumbnails in pixels')
+gflags.DEFINE_string('screenshot_format', 'jpeg',
+                     'Screenshot encoding, jpeg or png')
+gflags.DEFINE_integer('screenshot_quality', 75, 'JPEG screenshot quality')
+gflags.DEFINE_integer('screenshot_interval', 10,
+                      'Minimum seconds between screenshot captures')
+
+FLAGS = gflags.FLAGS
+
+# milliseconds to wait before trying a capture again while the stage is busy
+BUSY_RETRY = 100
+
+
+class Screenshot(object):
+  """An encoded thumbnail of the stage."""
+
+  def __init__(self, data, format, width, height, slideid, taken):
+    self.data = data
+    self.format = format
+    self.width = width
+    self.height = height
+    # id of the slide on screen when it was taken
+    self.slideid = slideid
+    self.taken = taken
+
+
+def thumbnail_size(width, height, target):
+  """Scale width x height down to at most target wide, keeping the aspect."""
+  if width <= target:
+    return width, height
+  return target, max(1, height * target / width)
+
+
+class Screenshotter(object):
+  """Takes rate limited screenshots of a stage."""
+
+  def __init__(self, stage, current=None, busy=None):
+    """
+    Args:
+       stage: (clutter.Stage) stage to capture
+       current: (callable) returns the id of the slide on screen
+       busy: (callable) True while the stage is between slides, e.g.
+             during a transition; captures wait until it is False
+    """
+    self.stage = stage
+    self.current = current
+    self.busy = busy
+    self.lock = thread.allocate_lock()
+    self.last = None
+    # callbacks waiting for the capture in flight, None if there is none
+    self.waiting = None
+    self.log = logging.getLogger('screenshot')
+
+  def request(self, callback):
+    """Get a screenshot. Safe to call from any thread.
+
+    Args:
+       callback: (callable) called with a Screenshot on the main loop, or
+                 with None if the capture failed
+    """
+    with self.lock:
+      last = self.last
+      fresh = (last is not None and
+               time.time() - last.taken < FLAGS.screenshot_interval)
+      if not fresh:
+        if self.waiting is not None:
+          self.waiting.append(callback)
+          return False
+        self.waiting = [callback]
+    if fresh:
+      gobject.idle_add(self.deliver, [callback], last)
+    else:
+      gobject.idle_add(self.capture)
+    return False
+
+  def capture(self):
+    """Read the stage's pixels. (Executed from a gobject idle callback)"""
+    if self.busy is not None and self.busy():
+      # A capture mid-transition would show two slides under one id.
+      gobject.timeout_add(BUSY_RETRY, self.capture)
+      return False
+    width, height = int(self.stage.get_width()), int(self.stage.get_height())
+    slideid = None
+    if self.current is not None:
+      slideid = self.current()
+    try:
+      data = self.stage.read_pixels(0, 0, width, height)
+    except Exception, e:
+      self.log.error('Could not read the stage: %s' % e)
+      data = None
+    if not data:
+      self.finish(None)
+      return False
+    worker = threading.Thread(target=self.encode,
+                              args=(data, width, height, slideid))
+    worker.setDaemon(True)
+    worker.start()
+    return False
+
+  def encode(self, data, width, height, slideid):
+    """Scale down and encode captured pixels. (Executed on a worker thread)"""
+    try:
+      pixbuf = gtk.gdk.pixbuf_new_from_data(data, gtk.gdk.COLORSPACE_RGB,
+                                            True, 8, width, height, width * 4)
+      thumbwidth, thumbheight = thumbnail_size(width, height,
+                                               FLAGS.screenshot_width)
+      pixbuf = pixbuf.scale_simple(thumbwidth, thumbheight,
+                                   gtk.gdk.INTERP_BILINEAR)
+      options = {}
+      if FLAGS.screenshot_format == 'jpeg':
+        options['quality'] = str(FLAGS.screenshot_quality)
+      chunks = []
+      pixbuf.save_to_callback(chunks.append, FLAGS.screenshot_format,
+                              options)
+      shot = Screenshot(''.join(chunks), FLAGS.screenshot_format,
+                        thumbwidth, thumbheight, slideid, time.time())
+    except Exception, e:
+      self.log.exception('Could not encode screenshot: %s' % e)
+      shot = None
+    gobject.idle_add(self.finish, shot)
+
+  def finish(self, shot):
+    """Hand a finished capture to everyone waiting for it."""
+    with self.lock:
+      if shot is not None:
+        self.last = shot
+      callbacks, self.waiting = self.waiting, None
+    self.deliver(callbacks or [], shot)
+    return False
+
+  def deliver(self, callbacks, shot):
+    for callback in callbacks:
+      try:
+        callback(shot)
+      except Exception, e:
+        self.log.exception('Screenshot callback failed: %s' % e)
+    return False
@@ -0,0 +1,177 @@
+#!/usr/bin/python
+"""CCIS Crew Digital Display System Frontend/Client
+
+This module keeps the slide cache directory under a size quota.
+
+Each slide has a directory <cache>/<id> holding its bundle. The time each
+slide was last shown is recorded, and when the slide directories together
+exceed the quota, the least recently shown ones are removed until they fit
+again. Directories of slides that are still wanted (in the playlist,
+loading, or in the lookahead window) are never removed.
+"""
+
+__author__ = 'CCIS Crew <crew@ccs.neu.edu>'
+
+
+import gflags
+import json
+import logging
+import os
+import shutil
+import tempfile
+import thread
+import time
+
+gflags.DEFINE_integer('cache_quota', 0,
+                      'Bytes the slide cache may use before the least'
+                      ' recently shown slides are removed (0 disables)')
+gflags.DEFINE_integer('cache_check_interval', 300,
+                      'Seconds between checks of the slide cache size')
+
+FLAGS = gflags.FLAGS
+
+LASTSHOWN = '.lastshown.js'
+# evicted directories are renamed to this prefix before removal
+TRASH = '.trash-'
+# seconds between saves of the last-shown times from touch()
+SAVE_INTERVAL = 60
+
+
+def directory_size(path):
+  """Get the bytes used by the files under path."""
+  total = 0
+  for root, unused_dirs, files in os.walk(path):
+    for name in files:
+      try:
+        total += os.lstat(os.path.join(root, name)).st_size
+      except OSError:
+        pass
+  return total
+
+
+class SlideCache(object):
+  """Slide directories under a cache root, with their last-shown times."""
+
+  def __init__(self, root):
+    """
+    Args:
+       root: (string) cache directory holding one directory per slide
+    """
+    self.root = root
+    self.lock = thread.allocate_lock()
+    # slide directory name -> time the slide was last shown
+    self.shown = {}
+    self.dirty = False
+    self.saved = 0
+    self.load()
+
+  def path(self):
+    return os.path.join(self.root, LASTSHOWN)
+
+  def load(self):
+    try:
+      f = open(self.path())
+      try:
+        self.shown = json.load(f)
+      finally:
+        f.close()
+    except (IOError, ValueError):
+      self.shown = {}
+
+  def save(self):
+    with self.lock:
+      self.saved = time.time()
+      if not self.dirty:
+        return
+      shown = dict(self.shown)
+      self.dirty = False
+    tmp = self.path() + '.tmp'
+    f = open(tmp, 'w')
+    try:
+      json.dump(shown, f)
+    finally:
+      f.close()
+    os.rename(tmp, self.path())
+
+  def touch(self, slideid, when=None):
+    """Record that a slide was shown, saving at most every SAVE_INTERVAL."""
+    with self.lock:
+      self.shown[str(slideid)] = when or time.time()
+      self.dirty = True
+      due = time.time() - self.saved >= SAVE_INTERVAL
+    if due:
+      try:
+        self.save()
+      except (IOError, OSError):
+        logging.exception('Could not save %s' % self.path())
+
+  def entries(self):
+    """List the slide directories, least recently shown first.
+
+    Walks every directory, so call it off the main loop.
+
+    Returns:
+       list of (last shown time, directory name, size in bytes). A slide
+       never shown counts as shown when its directory was last modified.
+    """
+    entries = []
+    for name in os.listdir(self.root):
+      path = os.path.join(self.root, name)
+      if (name.startswith(TRASH) or not os.path.isdir(path) or
+          os.path.islink(path)):
+        continue
+      with self.lock:
+        shown = self.shown.get(name)
+      if shown is None:
+        shown = os.path.getmtime(path)
+      entries.append((shown, name, directory_size(path)))
+    entries.sort()
+    return entries
+
+  def select(self, entries, quota, wanted):
+    """Pick the directories to evict to get under quota.
+
+    Args:
+       entries: (list) as returned by entries()
+       quota: (int) bytes the slide directories may use
+       wanted: (set) directory names of slides that must be kept
+
+    Returns:
+       (list) names of the directories to evict, least recently shown first
+    """
+    total = sum([size for unused_shown, unused_name, size in entries])
+    victims = []
+    for unused_shown, name, size in entries:
+      if total <= quota:
+        break
+      if name in wanted:
+        continue
+      victims.append(name)
+      total -= size
+    if total > quota:
+      logging.warning('Slide cache uses %d bytes, over its %d byte quota,'
+                      ' with only wanted slides left' % (total, quota))
+    return victims
+
+  def trash(self, name):
+    """Move a slide directory out of the way, to be removed by empty_trash.
+
+    This is a rename, cheap enough for the main loop, so the decision to
+    evict and the eviction happen without a load starting in between.
+    """
+    path = os.path.join(self.root, name)
+    if not os.path.isdir(path):
+      return False
+    logging.info('Evicting slide directory %s from the cache' % name)
+    os.rename(path, tempfile.mkdtemp(prefix=TRASH + name + '-',
+                                     dir=self.root))
+    with self.lock:
+      if self.shown.pop(name, None) is not None:
+        self.dirty = True
+    return True
+
+  def empty_trash(self):
+    """Remove evicted directories. (Executed off the main loop)"""
+    for name in os.listdir(self.root):
+      if name.startswith(TRASH):
+        shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
@@ -0,0 +1,108 @@
+#!/usr/bin/python
+"""CCIS Crew Digital Display System Frontend/Client
+
+This module keeps a compact on-disk index of the last applied playlist and
+the metadata of its slides, so a frontend can start showing cached slides
+right away at boot instead of waiting for the server.
+"""
+
+__author__ = 'CCIS Crew <crew@ccs.neu.edu>'
+
+
+import base64
+import json
+import logging
+import os
+import xmlrpclib
+
+VERSION = 1
+
+
+def encode(value):
+  """json default hook for the xmlrpclib values metadata can hold.
+
+  DateTime becomes its ISO 8601 string and Binary its data in base64, so
+  restored metadata has strings where the server sent these.
+  """
+  if isinstance(value, xmlrpclib.DateTime):
+    return value.value
+  if isinstance(value, xmlrpclib.Binary):
+    return base64.b64encode(value.data)
+  raise TypeError('%r is not JSON serializable' % value)
+
+
+def comparable(value):
+  """Get value as it reads after a save and load of the index."""
+  if isinstance(value, (xmlrpclib.DateTime, xmlrpclib.Binary)):
+    return encode(value)
+  return value
+
+
+class SlideIndex(object):
+  """Last known playlist entries and slide metadata, saved as JSON."""
+
+  def __init__(self, path):
+    """
+    Args:
+       path: (string) index file path
+    """
+    self.path = path
+    # slide id -> slide metadata dictionary
+    self.slides = {}
+    self.playlist = []
+    self.dirty = False
+
+  def load(self):
+    """Read the index from disk.
+
+    Returns:
+       True if a valid index was loaded, False otherwise.
+    """
+    try:
+      f = open(self.path)
+      try:
+        data = json.load(f)
+      finally:
+        f.close()
+    except IOError:
+      return False
+    except ValueError:
+      logging.warning('Ignoring corrupt slide index %s' % self.path)
+      return False
+    if not isinstance(data, dict) or data.get('version') != VERSION:
+      logging.warning('Ignoring slide index %s with unknown version'
+                      % self.path)
+      return False
+    self.slides = dict([(m['id'], m) for m in data['slides']])
+    self.playlist = data['playlist']
+    self.dirty = False
+    return True
+
+  def save(self):
+    """Write the index to disk if it changed since the last save."""
+    if not self.dirty:
+      return
+    tmp = self.path + '.tmp'
+    f = open(tmp, 'w')
+    try:
+      json.dump({'version': VERSION, 'playlist': self.playlist,
+                 'slides': self.slides.values()},
+                f, separators=(',', ':'), default=encode)
+    finally:
+      f.close()
+    os.rename(tmp, self.path)
+    self.dirty = False
+
+  def set_playlist(self, packet):
+    """Record a setPlaylist packet as the complete known state."""
+    self.slides = dict([(m['id'], m) for m in packet['slides']])
+    self.playlist = packet['playlist']
+    self.dirty = True
+
+  def set_slide(self, metadata):
+    self.slides[metadata['id']] = metadata
+    self.dirty = True
+
+  def remove_slide(self, slideid):
+    if self.slides.pop(slideid, None) is not None:
+      self.dirty = True
@@ -9,30 +9,43 @@ created for the visual representation of a slides content.
 __author__ = 'CCIS Crew <crew@ccs.neu.edu>'
 
 
+import bundle
 import clutter
 import config
+import delta
+import download
+import fontstore
 import gflags
 import gobject
-import hashlib
-import imp
 import json
 import logging
+import moduleloader
 import os
-import sys
+import parsefuture
+import sandbox
+import screenshot
+import slideindex
 import time
-import tarfile
 import urlparse
 import urllib
 import thread
-import shutil
+import threading
 
 gflags.DEFINE_boolean('enablescreenshot', False, 'Enable slide screenshots')
 gflags.DEFINE_boolean('enableresize', True, 'Enable slide scaling')
 gflags.DEFINE_integer('targetwidth', 1920, 'Target screen width')
 gflags.DEFINE_integer('targetheight', 1080, 'Target screen height')
+gflags.DEFINE_boolean('stream_bundles', True,
+                      'Extract bundles while they download')
+gflags.DEFINE_boolean('keep_bundles', False,
+                      'Keep a copy of each streamed bundle archive on disk')
+gflags.DEFINE_boolean('resume_streams', False,
+                      'Write streamed bundles to a partial file as well, so'
+                      ' a dropped download resumes instead of restarting')
 
 FLAGS = gflags.FLAGS
 
+
 class Slide(object):
   """Class representing all portions of a DDS Slide (metadata and content)."""
 
@@ -64,6 +77,15 @@ class Slide(object):
     self.lock = thread.allocate_lock()
     # gobject event source id of loop event
     self.loop_id = None
+    # work deferred until the lock is released, keyed by kind
+    self.pending = {}
+    # seconds the last parse took on the main loop
+    self.parse_time = None
+    # what a module slide allocated, and the package its module lives in
+    self.resources = None
+    self.package = None
+    # worker process running the module when --sandbox_modules is set
+    self.sandbox = None
 
   def __repr__(self):
     return str(self)
@@ -98,8 +120,32 @@ class Slide(object):
     slide.reload(metadata, width, height)
     return slide
 
+  @staticmethod
+  def create_slide_from_cache(metadata, width, height):
+    """Given slide metadata, create a Slide instance from the on-disk cache.
+
+    Nothing is downloaded; the bundle already in the slide directory is
+    parsed. The metadata is recorded so the slide compares as current
+    against the same metadata from the server.
+
+    Args:
+       metadata: (dictionary) Slide metadata
+
+    Returns:
+       Slide instance.
+    """
+    logging.debug('creating slide %s from cache' % metadata['id'])
+    slide = Slide()
+    with slide.lock:
+      slide.populate_info(metadata)
+      slide.load_slide_id(metadata['id'])
+      if slide.group:
+        slide.resize(width, height)
+    return slide
+
   def needs_update(self, metadata):
-    needed = self.timestamp != metadata['modified']
+    needed = (slideindex.comparable(self.timestamp) !=
+              slideindex.comparable(metadata['modified']))
     if needed:
       logging.warning('%s needs update per timestamp' % str(self))
     return needed
@@ -123,21 +169,50 @@ class Slide(object):
        metadata: (dictionary) Slide metadata
     """
     if self.lock.locked():
-      logging.debug('Failed to reload %s due to lock. Trying again...')
-      gobject.timeout_add(5000, lambda: self.reload(metadata, width, height))
+      logging.debug('Deferring reload of %s until it is released' % self)
+      self.defer('reload', lambda: self.reload(metadata, width, height))
       return
 
     logging.debug('Using lock')
     with self.lock:
       logging.debug('reloading %s from metadata' % self)
       self.populate_info(metadata)
-      self.retrieve_bundle(metadata['url'], self.slide_dir())
-      self.parse_bundle(self.slide_dir(), force=True)
+      changed = self.retrieve_bundle(metadata['url'], self.slide_dir())
+      self.parse_bundle(self.slide_dir(), force=True, extract=changed)
       if self.group:
         self.resize(width, height)
       else:
         logging.error('Slide not parsed after parse_bundle! Skipping resize!')
 
+  def defer(self, kind, callback):
+    """Run callback once the slide's lock is released.
+
+    Only the most recent callback of each kind is kept, so repeated requests
+    while the slide is on screen collapse into one.
+
+    Args:
+       kind: (string) 'reload' or 'remove'
+       callback: callable taking no arguments
+    """
+    self.pending[kind] = callback
+
+  def cancel_deferred(self, kind):
+    """Drop deferred work of a kind, e.g. a removal overtaken by a re-add."""
+    self.pending.pop(kind, None)
+
+  def release(self):
+    """Release the slide's lock and run any work deferred until then.
+
+    A pending removal wins over a pending reload.
+    """
+    self.lock.release()
+    pending = self.pending
+    self.pending = {}
+    if 'remove' in pending:
+      pending['remove']()
+    elif 'reload' in pending:
+      pending['reload']()
+
   def slide_dir(self):
     """Get the filesystem directory containing this slide data."""
     if self.dir is None:
@@ -168,18 +243,65 @@ class Slide(object):
     self.db_id = metadata['id']
     self.timestamp = metadata['modified']
 
-  #TODO(wan): Write the retry code.
-  def retrieve_bundle(self, url, directory, unused_retry=False):
+  def retrieve_bundle(self, url, directory, retry=True):
     """Download an slide bundle to disk.
 
     Args:
        url: url to the bundle file.
        directory: the directory to download the bundle to. It'll always be
                   named bundle.tar.gz.
-       unused_retry: (Boolean) Should the fetch be retried if it fails
+       retry: (Boolean) Should the fetch be retried if it fails
+
+    Returns:
+       True if the bundle changed and needs extracting, False if the copy
+       already extracted in directory is current.
     """
     bundle_path = os.path.join(directory, 'bundle.tar.gz')
-    urllib.urlretrieve(url, bundle_path)
+    extracted = os.path.exists(os.path.join(directory, 'manifest.js'))
+    attempts = None
+    if not retry:
+      attempts = 1
+    if FLAGS.delta_bundles and bundle.load_manifest(directory).get('members'):
+      try:
+        if delta.update(url, directory) is not None:
+          return False
+      except (delta.DeltaError, IOError), e:
+        logging.warning('Delta update of %s failed, fetching whole bundle: %s'
+                        % (url, e))
+    if FLAGS.stream_bundles:
+      return self.stream_bundle(url, directory, bundle_path, extracted,
+                                attempts)
+    return download.fetch_retrying(url, bundle_path, attempts,
+                                   conditional=extracted)
+
+  def stream_bundle(self, url, directory, bundle_path, conditional,
+                    attempts=None):
+    """Download a bundle and extract it as it arrives.
+
+    Returns:
+       False, as nothing is left to extract afterwards.
+    """
+    extractors = []
+    def consume(stream):
+      # A retry starts over, so drop what a failed attempt staged.
+      for extractor in extractors:
+        extractor.abort()
+      del extractors[:]
+      extractors.append(bundle.extract_stream(stream, directory))
+    try:
+      download.fetch_retrying(url, bundle_path, attempts,
+                              conditional=conditional, consumer=consume,
+                              keep=FLAGS.keep_bundles,
+                              resume=FLAGS.resume_streams)
+    except:
+      for extractor in extractors:
+        extractor.abort()
+      raise
+    if extractors:
+      extractors[0].commit(download.load_meta(bundle_path).get('sha1'))
+      logging.debug('Streamed %d members of %s into %s'
+                    % (extractors[0].written, url, directory))
+    return False
 
   def get_parser_method(self, modename=None):
     """Using self.mode, get the method to use for parsing this slide."""
@@ -205,14 +327,17 @@ class Slide(object):
   def extract_bundle(self, directory):
     bundle_path = os.path.join(directory, 'bundle.tar.gz')
     if not os.path.exists(bundle_path):
+      if bundle.load_manifest(directory).get('bundle'):
+        # Streamed without keeping the archive; already extracted.
+        return True
       logging.error('Bundle path %s does not exist' % bundle_path)
       return False
-    bundle = tarfile.open(bundle_path)
-    bundle.extractall(directory)
+    sha1 = download.load_meta(bundle_path).get('sha1')
+    bundle.extract(bundle_path, directory, sha1)
     return True
 
-  def parse_bundle(self, directory, force=False):
-    if not self.extract_bundle(directory):
+  def parse_bundle(self, directory, force=False, extract=True):
+    if extract and not self.extract_bundle(directory):
       logging.error('Could not extract bundle for %s in %s' % (self, directory))
       return False
     return self.parse_directory(directory, force)
@@ -220,12 +345,15 @@ class Slide(object):
   def install_fonts(self, directory):
     if 'fonts' in self.manifest:
       fonts = self.manifest['fonts']
-      fonts_directory = os.path.expanduser('~/.fonts/')
-      if not os.path.exists(fonts_directory):
-        os.makedirs(fonts_directory)
-      for font_path in fonts:
-        shutil.copy(os.path.join(directory, font_path),
-          os.path.join(fonts_directory, os.path.basename(font_path)))
+      # The extraction manifest already knows the hash of each member.
+      members = bundle.load_manifest(directory).get('members', {})
+      paths = [os.path.join(directory, font_path) for font_path in fonts]
+      hashes = dict([(os.path.join(directory, font_path),
+                      members[font_path][2])
+                     for font_path in fonts if font_path in members])
+      # The layout comes right after this, so new fonts must be in the
+      # font cache before returning.
+      fontstore.get_store().install(self.id(), paths, hashes, urgent=True)
 
   def parse_directory(self, directory, force=False):
     """Parse the bundle in the given directory into self.slide."""
@@ -237,22 +365,48 @@ class Slide(object):
     self.duration = self.manifest['duration']
     self.priority = self.manifest['priority']
     self.install_fonts(directory)
-    gobject.timeout_add(1, self.run_parser)
-    parsestart = time.time()
-    while self.group is None:
-      if time.time() - parsestart < self.timeout:
-        logging.info('waiting')
-        time.sleep(0.8)
-      else:
-        logging.error('Could not parse %s fast enough!' % str(self))
-        return False
+    future = parsefuture.ParseFuture()
+    if threading.currentThread().getName() == 'MainThread':
+      self.run_parser(future)
+    else:
+      gobject.idle_add(self.run_parser, future)
+    try:
+      self.group, self.app = future.wait(self.timeout)
+    except parsefuture.ParseTimeout:
+      logging.error('Could not parse %s fast enough!' % str(self))
+      return False
+    except Exception, e:
+      logging.error('Could not parse %s: %s' % (self, e))
+      return False
+    logging.info('Parsed %s in %.3fs' % (self, self.parse_time))
     self.setupevents()
-    return self.group is None
+    return self.group is not None
 
-  def run_parser(self):
-    """Run the parser for this slide (Executed from a gobject timeout)."""
-    parser = self.get_parser_method()
-    self.group, self.app = parser(self.get_layout_file(), self.slide_dir())
+  def run_parser(self, future):
+    """Run the parser for this slide (Executed from a gobject idle callback).
+
+    Args:
+       future: (parsefuture.ParseFuture) resolved with the (group, app) pair, or with the
+               exception raised while parsing
+    """
+    start = time.time()
+    try:
+      parser = self.get_parser_method()
+      group, app = parser(self.get_layout_file(), self.slide_dir())
+    except Exception, e:
+      self.parse_time = time.time() - start
+      future.set_exception(e)
+      return False
+    self.parse_time = time.time() - start
+    if not future.set_result((group, app)):
+      # The waiter timed out and reported failure; nothing will show or
+      # release this group, so drop it and its module now.
+      logging.warning('Discarding %s, parsed %.3fs after giving up'
+                      % (self, self.parse_time))
+      self.release_module()
+      if group:
+        group.destroy()
+    return False
 
   def parse_json(self, filename, directory):
     """Parses the given json file into a slide.
@@ -282,52 +436,124 @@ class Slide(object):
     Returns:
       Parsed slide from setupNewSlide
     """
+    self.release_module()
+    if FLAGS.sandbox_modules:
+      return self.parse_sandboxed(filename, directory)
+    self.resources = moduleloader.SlideResources()
     try:
-      slidemodule = self.load_module(filename, directory)
+      slidemodule = self.load_module(filename, directory, self.resources)
+      self.package = slidemodule.__package__
       return (slidemodule.slide, slidemodule.app)
 
     except Exception, e:
       logging.exception('Could not load module %s in dir %s because %s'
                         % (filename, directory, e))
+      self.release_module()
+
+  def parse_sandboxed(self, filename, directory):
+    """Returns a slide whose module runs in a sandbox worker process.
 
-  def load_module(self, codepath, directory):
+    The group shows the frames the worker renders, and the app forwards
+    the event hooks to it.
+    """
+    try:
+      self.sandbox = sandbox.SandboxClient(directory, filename,
+                                           FLAGS.targetwidth,
+                                           FLAGS.targetheight)
+      return (self.sandbox.group, self.sandbox)
+    except Exception, e:
+      logging.exception('Could not start sandbox for %s in dir %s because %s'
+                        % (filename, directory, e))
+      self.release_module()
+
+  def load_module(self, codepath, directory, resources=None):
     """Returns the module object for the python file at the given path.
 
     Args:
       codepath: (string) filename to load
       directory: (string) directory that filename resides in
+      resources: (SlideResources) records what the module allocates
     """
-    fin = None
-    try:
-      currentdirectory = os.getcwd()
-      currentpath = sys.path
-      sys.path.append(directory)
-      os.chdir(directory)
-      fin = open(codepath, 'rb')
-      module = imp.load_source(hashlib.sha1(codepath).hexdigest(), codepath,
-                               fin)
-      os.chdir(currentdirectory)
-      sys.path = currentpath
-      return module
-    finally:
-      if fin:
-        fin.close()
+    return moduleloader.load_slide_module(codepath, directory, resources)
+
+  def release_module(self):
+    """Release what the slide module allocated and unload its package."""
+    if self.sandbox is not None:
+      self.sandbox.close()
+      self.sandbox = None
+    if self.resources is not None:
+      self.resources.release()
+      self.resources = None
+    if self.package is not None:
+      moduleloader.unload_package(self.package)
+      self.package = None
+
+  def release_resources(self):
+    """Free everything this slide holds once it is removed or replaced."""
+    self.stop_event_loop()
+    self.release_module()
+    if self.group:
+      self.group.destroy()
+    self.group = None
+    self.app = None
+
+  def memory_report(self):
+    """Describe what this slide currently keeps alive.
 
-  def screenshot_path(self):
+    Returns:
+       dictionary of counts: actors and textures in the group (with an
+       estimate of texture memory in bytes), modules loaded in the slide
+       package, and tracked event sources, timelines and textures.
+    """
+    report = {'actors': 0, 'textures': 0, 'texture_bytes': 0,
+              'modules': 0, 'sources': 0, 'timelines': 0,
+              'tracked_textures': 0}
+    pending = [self.group] if self.group else []
+    while pending:
+      actor = pending.pop()
+      report['actors'] += 1
+      if isinstance(actor, clutter.Texture):
+        width, height = actor.get_base_size()
+        report['textures'] += 1
+        report['texture_bytes'] += width * height * 4
+      if hasattr(actor, 'get_children'):
+        pending.extend(actor.get_children())
+    if self.package is not None:
+      report['modules'] = len(moduleloader.package_modules(self.package))
+    if self.resources is not None:
+      tracked = self.resources.report()
+      report['sources'] = tracked['sources']
+      report['timelines'] = tracked['timelines']
+      report['tracked_textures'] = tracked['textures']
+    return report
+
+  def screenshot_path(self, format='png'):
     basepath = os.path.join(config.Option('cache'), '..', 'screenshots')
     if not os.path.exists(basepath):
       os.mkdir(basepath)
-    return os.path.join(basepath, 'slide-%s.png' % self.id())
+    return os.path.join(basepath, 'slide-%s.%s' % (self.id(), format))
 
-  def take_screenshot(self):
-    if FLAGS.enablescreenshot and not os.path.exists(self.screenshot_path()):
-      gobject.timeout_add(500, self.do_take_screenshot)
+  def take_screenshot(self, screenshotter):
+    """Save a screenshot of this slide shortly after it is shown, once.
 
-  def do_take_screenshot(self):
-    logging.info('Taking screenshot')
-    os.system("import -window root -silent %s"
-              % self.screenshot_path())
-    return False
+    Args:
+       screenshotter: (screenshot.Screenshotter) of the stage
+    """
+    path = self.screenshot_path(FLAGS.screenshot_format)
+    if FLAGS.enablescreenshot and not os.path.exists(path):
+      gobject.timeout_add(500, screenshotter.request, self.save_screenshot)
+
+  def save_screenshot(self, shot):
+    if shot is None or shot.slideid != self.id():
+      return
+    path = self.screenshot_path(shot.format)
+    logging.info('Saving screenshot of %s to %s' % (self, path))
+    f = open(path + '.tmp', 'wb')
+    try:
+      f.write(shot.data)
+    finally:
+      f.close()
+    os.rename(path + '.tmp', path)
 
   def resize(self, current_width, current_height):
     if ((current_width == FLAGS.targetwidth) and
@@ -347,7 +573,10 @@ class Slide(object):
       if hasattr(self.app, n):
         def callmethod():
           logging.info('Calling %s in %s' % (n, self))
-          f = getattr(self.app, n)
+          f = getattr(self.app, n, None)
+          if f is None:
+            logging.warning('%s called in released %s' % (n, self))
+            return
           gobject.timeout_add(1, f)
           logging.info('Calling %s in %s complete' % (n, self))
         setattr(self, n,  callmethod)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# vim: set shiftwidth=4 tabstop=4 softtabstop=4 :
+"""slide transitions
+"""
+
+import gflags
+import logging
+import clutter
+
+FLAGS = gflags.FLAGS
+
+gflags.DEFINE_boolean('transitions', True, 'Fade in and out slides')
+gflags.DEFINE_integer('transition_duration', 500,
+                      'Length of slide transitions in milliseconds')
+gflags.DEFINE_string('default_transition', 'crossfade',
+                     'Transition used when a slide does not name a known one')
+
+# Manifest transition names and the kind of transition they map to.
+TRANSITIONS = {'crossfade': 'crossfade', 'fade': 'crossfade',
+               'none': 'cut', 'cut': 'cut'}
+
+
+class TransitionEngine(object):
+    """Runs slide transitions on a single pooled timeline.
+
+    The timeline, alpha and the two opacity behaviours are created once
+    and reused for every transition, so advancing a slide allocates no
+    clutter objects. A cross-fade animates the outgoing and incoming groups
+    on the same timeline, with nothing in between.
+    """
+    def __init__(self, stage):
+        self.stage = stage
+        self.log = logging.getLogger('transition')
+        self.timeline = clutter.Timeline(FLAGS.transition_duration)
+        self.alpha = clutter.Alpha(self.timeline, clutter.LINEAR)
+        self.fade_out = clutter.BehaviourOpacity(alpha=self.alpha,
+                                                 opacity_start=255,
+                                                 opacity_end=0)
+        self.fade_in = clutter.BehaviourOpacity(alpha=self.alpha,
+                                                opacity_start=0,
+                                                opacity_end=255)
+        self.timeline.connect('completed', self.on_completed)
+        # (outgoing, incoming, callback) of the running transition
+        self.running = None
+
+    def kind(self, slide):
+        """Get the transition kind to use for showing the given slide."""
+        if not FLAGS.transitions:
+            return 'cut'
+        name = slide.transition
+        if name not in TRANSITIONS:
+            name = FLAGS.default_transition
+        return TRANSITIONS.get(name, 'crossfade')
+
+    def run(self, outgoing, incoming, callback):
+        """Transition from one slide to another.
+
+        Args:
+           outgoing: (Slide) slide leaving the screen, or None
+           incoming: (Slide) slide to show
+           callback: called with (outgoing, incoming) once the incoming
+                     slide is fully shown
+        """
+        if self.running:
+            self.timeline.stop()
+            self.on_completed(self.timeline)
+        group = incoming.group
+        if group.get_parent() is None:
+            self.stage.add(group)
+        group.raise_top()
+        group.show()
+        kind = self.kind(incoming)
+        self.log.debug('%s transition from %s to %s'
+                       % (kind, outgoing, incoming))
+        if kind == 'cut' or outgoing is incoming:
+            group.set_opacity(255)
+            callback(outgoing, incoming)
+            return
+        group.set_opacity(0)
+        self.fade_in.apply(group)
+        if outgoing is not None:
+            self.fade_out.apply(outgoing.group)
+        self.running = (outgoing, incoming, callback)
+        self.timeline.rewind()
+        self.timeline.start()
+
+    def finish(self):
+        """Complete the running transition immediately, skipping its callback.
+
+        Used when the incoming slide is about to be replaced itself, so
+        nothing should be started for it; the caller cleans up instead.
+
+        Returns:
+           (outgoing, incoming) of the finished transition, or None if
+           no transition was running
+        """
+        self.timeline.stop()
+        finished = self.complete()
+        if finished is None:
+            return None
+        outgoing, incoming, unused_callback = finished
+        return outgoing, incoming
+
+    def complete(self):
+        """Stop animating and return the (outgoing, incoming, callback)."""
+        if self.running is None:
+            return None
+        finished = self.running
+        self.running = None
+        self.fade_in.remove_all()
+        self.fade_out.remove_all()
+        finished[1].group.set_opacity(255)
+        return finished
+
+    def on_completed(self, unused_timeline):
+        finished = self.complete()
+        if finished is not None:
+            outgoing, incoming, callback = finished
+            callback(outgoing, incoming)
@@ -15,6 +15,7 @@ import threading
 import os
 import displaycontrol
 import gflags
+import Queue
 
 # This should be a list of XMPP resource strings that the server understands.
 ALLOWABLERESOURCES = ['dds-client']
@@ -32,6 +33,8 @@ class XMPPThread(threading.Thread):
     self.connection = None
     self.status = xmpp.Presence()
     self.display = displaycontrol.get_controller()
+    # stanzas from other threads, sent by this thread between Process calls
+    self.outgoing = Queue.Queue()
 
   def AttachSlideManager(self, slidemanager):
     """Attach a slide manager to this thread.
@@ -51,7 +54,7 @@ class XMPPThread(threading.Thread):
     # Say hello to the dds-master server with current slideid
     self.status = xmpp.Presence(to=config.Option("server-jid"))
     self.status.setStatus(str(slide.id()))
-    self.connection.send(self.status)
+    self.Send(self.status)
 
   def AddSlide(self, slidetuple):
     """XMPP AddSlide method handler.
@@ -60,7 +63,9 @@ class XMPPThread(threading.Thread):
        slidetuple: (tuple) (slide metadata)
     """
     logging.info('XMPP addSlide request')
-    self.slidemanager.add_slide(slidetuple[0])
+    metadata = slidetuple[0]
+    self.slidemanager.commands.put(('addSlide', metadata['id']),
+                                   self.slidemanager.add_slide, metadata)
 
   def SetPlaylist(self, datatuple):
     """XMPP SetPlaylist method handler.
@@ -69,12 +74,9 @@ class XMPPThread(threading.Thread):
        datatuple: (tuple) (playlist metadata)
     """
     logging.info('XMPP setPlaylist request')
-    self.slidemanager.slides.playlist.purge()
-    packet = datatuple[0]
-    for i in packet['playlist']:
-      self.slidemanager.slides.playlist.add(i)
-    for slide in packet['slides']:
-      self.slidemanager.add_slide(slide)
+    self.slidemanager.commands.put(('playlist',),
+                                   self.slidemanager.set_playlist,
+                                   datatuple[0])
 
   def RemoveSlide(self, slidetuple):
     """XMPP RemoveSlide method handler.
@@ -83,7 +85,9 @@ class XMPPThread(threading.Thread):
        slidetuple: (tuple)
     """
     logging.info("XMPP removeSlide request")
-    self.slidemanager.remove_slide(slidetuple[0])
+    self.slidemanager.commands.put(('removeSlide', slidetuple[0]),
+                                   self.slidemanager.remove_slide,
+                                   slidetuple[0])
 
   def DisplayControl(self, datatuple):
     logging.info("XMPP dplyControl request")
@@ -108,11 +112,56 @@ class XMPPThread(threading.Thread):
        slidetuple: (tuple) (slide metadata)
     """
     logging.info('XMPP updateSlide request')
-    self.slidemanager.update_slide(slidetuple[0])
+    metadata = slidetuple[0]
+    self.slidemanager.commands.put(('updateSlide', metadata['id']),
+                                   self.slidemanager.update_slide, metadata)
+
+  def GetScreenshot(self, unused_slidetuple, reply):
+    """XMPP GetScreenshot method handler.
+
+    Answers with a thumbnail of the stage, whichever slide is on screen.
+    Requests are rate limited by the screenshotter, so frequent polls get
+    a recent capture instead of a new one.
 
-  def GetScreenshot(self, slidetuple):
-    logging.warning('STUB: Haven\'t written this code yet. (GetScreenshot)')
-    return
+    Args:
+       unused_slidetuple: (tuple)
+       reply: (callable) sends the IQ result
+    """
+    logging.info('XMPP getScreenshot request')
+
+    def send(shot):
+      if shot is None:
+        reply({})
+        return
+      result = {'format': shot.format, 'width': shot.width,
+                'height': shot.height, 'taken': int(shot.taken),
+                'data': xmlrpclib.Binary(shot.data)}
+      if shot.slideid is not None:
+        result['slide'] = shot.slideid
+      reply(result)
+
+    self.slidemanager.screenshots.request(send)
+
+  def Reply(self, iq, result):
+    """Answer an RPC IQ with result."""
+    response = iq.buildReply('result')
+    response.setQueryNS(xmpp.NS_RPC)
+    response.setQueryPayload([xmpp.simplexml.XML2Node(
+        xmlrpclib.dumps((result,), methodresponse=True))])
+    self.Send(response)
+
+  def Send(self, stanza):
+    """Queue a stanza to be sent by the XMPP thread. Safe from any thread."""
+    self.outgoing.put(stanza)
+
+  def SendQueued(self):
+    """Send the stanzas queued by other threads. (XMPP thread only)"""
+    while True:
+      try:
+        stanza = self.outgoing.get_nowait()
+      except Queue.Empty:
+        return
+      self.connection.send(stanza)
 
 #### End XMPP Actions
 
@@ -123,6 +172,7 @@ class XMPPThread(threading.Thread):
        True if connection is alive, False if dead.
     """
     try:
+      self.SendQueued()
       self.connection.Process(1)
       return True
     except KeyboardInterrupt:
@@ -179,11 +229,13 @@ class XMPPThread(threading.Thread):
     methods = { "addSlide"      : self.AddSlide,
                 "removeSlide"   : self.RemoveSlide,
                 "updateSlide"   : self.UpdateSlide,
-                "getScreenshot" : self.GetScreenshot,
                 "setPlaylist"   : self.SetPlaylist,
                 "dplyControl"   : self.DisplayControl,
                 "killDDS"       : self.KillDDS,
               }
+    # handlers that answer the IQ, possibly later, through a reply callable
+    replying = { "getScreenshot" : self.GetScreenshot,
+               }
 
     # pylint: disable-msg=C0103
     def handleIq(unused_connection, iq):
@@ -199,6 +251,9 @@ class XMPPThread(threading.Thread):
           # and the only argument we want is the first one
           if methodName in methods:
             methods[methodName](payload[0])
+          elif methodName in replying:
+            replying[methodName](payload[0],
+                                 lambda result: self.Reply(iq, result))
           else:
             logging.error("rpc function " + methodName +
                           " is not defined")
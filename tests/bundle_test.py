@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+import os
+import shutil
+import StringIO
+import tarfile
+import tempfile
+import unittest
+
+import bundle
+
+
+def make_bundle(path, members, mtime=1000):
+  """Write a tar.gz at path holding members (name -> data)."""
+  tar = tarfile.open(path, 'w:gz')
+  for name, data in sorted(members.items()):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = mtime
+    tar.addfile(info, StringIO.StringIO(data))
+  tar.close()
+
+
+class BundleTest(unittest.TestCase):
+
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.bundle = os.path.join(self.dir, 'bundle.tar.gz')
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def read(self, name):
+    return open(os.path.join(self.dir, name)).read()
+
+  def test_extract(self):
+    make_bundle(self.bundle, {'manifest.js': '{}', 'img/a.png': 'aaa'})
+    self.assertEqual(2, bundle.extract(self.bundle, self.dir))
+    self.assertEqual('{}', self.read('manifest.js'))
+    self.assertEqual('aaa', self.read('img/a.png'))
+    self.assertEqual(0, bundle.extract(self.bundle, self.dir))
+    self.assertEqual([], [x for x in os.listdir(self.dir)
+                          if x.startswith('.staging')])
+
+  def test_extract_changed_members(self):
+    make_bundle(self.bundle, {'manifest.js': '{}', 'a': 'aaa', 'b': 'bbb'})
+    bundle.extract(self.bundle, self.dir)
+    make_bundle(self.bundle, {'manifest.js': '{}', 'a': 'AAAA'}, mtime=2000)
+    self.assertEqual(1, bundle.extract(self.bundle, self.dir))
+    self.assertEqual('AAAA', self.read('a'))
+    self.assertEqual(False, os.path.exists(os.path.join(self.dir, 'b')))
+
+  def test_missing_member_reextracts(self):
+    make_bundle(self.bundle, {'manifest.js': '{}', 'a': 'aaa'})
+    bundle.extract(self.bundle, self.dir)
+    os.remove(os.path.join(self.dir, 'a'))
+    self.assertEqual(1, bundle.extract(self.bundle, self.dir))
+    self.assertEqual('aaa', self.read('a'))
+
+  def test_unsafe_member(self):
+    make_bundle(self.bundle, {'../evil': 'x', 'manifest.js': '{}'})
+    bundle.extract(self.bundle, self.dir)
+    self.assertEqual(False,
+                     os.path.exists(os.path.join(self.dir, '..', 'evil')))
+
+  def test_symlink_member(self):
+    outside = tempfile.mkdtemp()
+    try:
+      tar = tarfile.open(self.bundle, 'w:gz')
+      link = tarfile.TarInfo('fonts')
+      link.type = tarfile.SYMTYPE
+      link.linkname = outside
+      tar.addfile(link)
+      info = tarfile.TarInfo('fonts/evil')
+      info.size = 1
+      tar.addfile(info, StringIO.StringIO('x'))
+      tar.close()
+      target = os.path.join(self.dir, 'slide')
+      os.mkdir(target)
+      bundle.extract(self.bundle, target)
+      self.assertEqual([], os.listdir(outside))
+      self.assertEqual(False, os.path.islink(os.path.join(target, 'fonts')))
+      self.assertEqual('x', self.read('slide/fonts/evil'))
+    finally:
+      shutil.rmtree(outside)
+
+  def test_extract_stream(self):
+    make_bundle(self.bundle, {'manifest.js': '{}', 'img/a.png': 'aaa'})
+    target = os.path.join(self.dir, 'slide')
+    os.mkdir(target)
+    extractor = bundle.extract_stream(open(self.bundle, 'rb'), target)
+    self.assertEqual(False, os.path.exists(os.path.join(target, 'img')))
+    extractor.commit('abc')
+    self.assertEqual('aaa', self.read('slide/img/a.png'))
+    self.assertEqual(True, bundle.up_to_date(target, 'abc'))
+
+if __name__ == '__main__':
+    unittest.main()
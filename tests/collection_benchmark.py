@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""Micro-benchmark for Collection add/remove/lookup cost.
+
+Run from the tests directory:
+   python collection_benchmark.py
+"""
+import logging
+import sys
+import timeit
+
+sys.path.append("../src/dds")
+import collection
+
+SIZES = [10, 1000, 10000]
+ROUNDS = 1000
+
+
+class FakeSlide(object):
+
+  def __init__(self, id):
+    self.db_id = id
+
+  def id(self):
+    return self.db_id
+
+
+def build(size):
+  col = collection.Collection()
+  for i in xrange(size):
+    col.add_slide(FakeSlide(i))
+  return col
+
+
+def bench(size):
+  col = build(size)
+  probe = FakeSlide(size)
+  middle = size / 2
+
+  def add_remove():
+    col.add_slide(probe)
+    col.remove_slide(probe)
+
+  results = {}
+  results['add+remove'] = min(timeit.repeat(add_remove, number=ROUNDS,
+                                            repeat=3))
+  results['get_by_id'] = min(timeit.repeat(lambda: col.get_by_id(middle),
+                                           number=ROUNDS, repeat=3))
+  results['id_exists'] = min(timeit.repeat(lambda: col.id_exists(middle),
+                                           number=ROUNDS, repeat=3))
+  return results
+
+
+def main():
+  logging.disable(logging.CRITICAL)
+  print '%8s %14s %14s %14s' % ('slides', 'add+remove', 'get_by_id',
+                                'id_exists')
+  for size in SIZES:
+    r = bench(size)
+    print '%8d %12.2fus %12.2fus %12.2fus' % (
+        size, r['add+remove'] * 1e6 / ROUNDS, r['get_by_id'] * 1e6 / ROUNDS,
+        r['id_exists'] * 1e6 / ROUNDS)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+import unittest
+import xmlrpclib
+
+import collection
+
+
+class FakeSlide(object):
+
+  def __init__(self, id, timestamp=None):
+    self.db_id = id
+    self.timestamp = timestamp
+
+  def id(self):
+    return self.db_id
+
+
+class CollectionTest(unittest.TestCase):
+
+  def setUp(self):
+    self.col = collection.Collection()
+
+  def tearDown(self):
+    del self.col
+
+  def test_add_slide(self):
+    self.assertEqual(True, self.col.empty())
+    a = FakeSlide(1)
+    self.col.add_slide(a)
+    self.assertEqual(False, self.col.empty())
+    self.assertEqual(True, self.col.id_exists(1))
+    self.assertEqual(a, self.col.get_by_id(1))
+    self.col.add_slide(FakeSlide(1))
+    self.assertEqual(a, self.col.get_by_id(1))
+    self.assertEqual(False, self.col.has_multiple())
+
+  def test_remove_slide(self):
+    a = FakeSlide(1)
+    self.col.add_slide(a)
+    self.col.remove_slide(a)
+    self.assertEqual(False, self.col.id_exists(1))
+    self.assertEqual(None, self.col.get_by_id(1))
+    self.col.remove_slide(a)
+    self.assertEqual(True, self.col.empty())
+
+  def test_id_list_order(self):
+    for id in [5, 3, 9, 1]:
+      self.col.add_slide(FakeSlide(id))
+    self.col.remove_slide(FakeSlide(9))
+    self.col.add_slide(FakeSlide(7))
+    self.assertEqual([5, 3, 1, 7], self.col.id_list())
+
+  def test_diff_slides(self):
+    self.col.add_slide(FakeSlide(1, 'a'))
+    self.col.add_slide(FakeSlide(2, 'a'))
+    self.col.add_slide(FakeSlide(3, 'a'))
+    added, updated, removed = self.col.diff_slides([
+        {'id': 1, 'modified': 'a'},
+        {'id': 2, 'modified': 'b'},
+        {'id': 4, 'modified': 'a'}])
+    self.assertEqual([4], [x['id'] for x in added])
+    self.assertEqual([2], [x['id'] for x in updated])
+    self.assertEqual([3], removed)
+
+  def test_diff_restored_timestamp(self):
+    # Restored from the slide index, where DateTime was saved as a string.
+    self.col.add_slide(FakeSlide(1, '20261018T09:30:00'))
+    added, updated, removed = self.col.diff_slides([
+        {'id': 1, 'modified': xmlrpclib.DateTime('20261018T09:30:00')}])
+    self.assertEqual(([], [], []), (added, updated, removed))
+
+  def test_current_slide_replaced(self):
+    self.col.playlist.add({'position': 1, 'mode': 'single', 'slides': [1],
+                           'weights': [1]})
+    old = FakeSlide(1, 'a')
+    self.col.add_slide(old)
+    self.assert_(self.col.current_slide() is old)
+    new = FakeSlide(1, 'b')
+    self.col.remove_slide(old)
+    self.col.add_slide(new)
+    self.col.advance()
+    self.assert_(self.col.current_slide() is new)
+
+if __name__ == '__main__':
+    unittest.main()
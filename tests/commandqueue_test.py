@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+import unittest
+
+try:
+  import commandqueue
+except ImportError:
+  commandqueue = None
+
+
+class CommandQueueTest(unittest.TestCase):
+  """Needs gobject, which commandqueue schedules its drain with."""
+
+  def setUp(self):
+    if commandqueue is None:
+      self.skipTest('needs gobject')
+    self.queue = commandqueue.CommandQueue()
+    self.ran = []
+
+  def run_command(self, name):
+    self.ran.append(name)
+
+  def test_order(self):
+    self.queue.put(None, self.run_command, 'a')
+    self.queue.put(None, self.run_command, 'b')
+    while self.queue.drain():
+      pass
+    self.assertEqual(['a', 'b'], self.ran)
+
+  def test_coalesced_moves_to_end(self):
+    self.queue.put('x', self.run_command, 'x1')
+    self.queue.put(None, self.run_command, 'a')
+    self.queue.put('x', self.run_command, 'x2')
+    self.assertEqual(2, self.queue.depth())
+    while self.queue.drain():
+      pass
+    self.assertEqual(['a', 'x2'], self.ran)
+    self.assertEqual(1, self.queue.stats()['coalesced'])
+
+  def test_different_kinds_not_coalesced(self):
+    # An updateSlide right after the addSlide of a new slide must not
+    # replace it: the update does nothing for a slide never loaded.
+    self.queue.put(('addSlide', 1), self.run_command, 'add')
+    self.queue.put(('updateSlide', 1), self.run_command, 'update')
+    self.assertEqual(2, self.queue.depth())
+    while self.queue.drain():
+      pass
+    self.assertEqual(['add', 'update'], self.ran)
+    self.assertEqual(0, self.queue.stats()['coalesced'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+import os
+import unittest
+
+import bundle
+import delta
+import deltaserver
+from bundle_test import make_bundle
+from download_test import ServerTestCase
+
+
+class CountingHandler(deltaserver.DeltaHandler):
+  """Delta handler that records the paths it was asked for."""
+
+  requests = []
+
+  def log_message(self, *args):
+    pass
+
+  def do_GET(self):
+    CountingHandler.requests.append(self.path)
+    deltaserver.DeltaHandler.do_GET(self)
+
+
+class DeltaTest(ServerTestCase):
+
+  handler = CountingHandler
+
+  def setUp(self):
+    ServerTestCase.setUp(self)
+    CountingHandler.requests[:] = []
+    self.bundle = os.path.join(self.server.root, 'bundle.tar.gz')
+    self.url = self.server.url('bundle.tar.gz')
+
+  def read(self, name):
+    return open(os.path.join(self.dir, name)).read()
+
+  def test_update_changed_member(self):
+    make_bundle(self.bundle, {'manifest.js': '{}', 'a': 'aaa', 'b': 'bbb',
+                              'img/c.png': 'ccc'})
+    bundle.extract(self.bundle, self.dir)
+    make_bundle(self.bundle, {'manifest.js': '{"x": 1}', 'a': 'aaa',
+                              'img/c.png': 'ccc'}, mtime=2000)
+    self.assertEqual(1, delta.update(self.url, self.dir))
+    self.assertEqual('{"x": 1}', self.read('manifest.js'))
+    self.assertEqual(False, os.path.exists(os.path.join(self.dir, 'b')))
+    members = [x for x in CountingHandler.requests
+               if delta.MEMBER_SUFFIX in x]
+    self.assertEqual(['/bundle.tar.gz.members/manifest.js'], members)
+    self.assertEqual(True, bundle.up_to_date(self.dir,
+                                             bundle.file_sha1(self.bundle)))
+    self.assertEqual(0, delta.update(self.url, self.dir))
+
+  def test_no_delta_support(self):
+    self.assertEqual(None, delta.update(self.server.url('missing.tar.gz'),
+                                        self.dir))
+
+  def test_bad_member_aborts(self):
+    make_bundle(self.bundle, {'manifest.js': '{}'})
+    bundle.extract(self.bundle, self.dir)
+    make_bundle(self.bundle, {'manifest.js': '{"x": 1}'}, mtime=2000)
+    remote = bundle.describe(self.bundle)
+    remote['members']['manifest.js'][2] = 'bogus'
+    deltaserver.MANIFESTS.manifests[self.bundle] = (
+        (os.stat(self.bundle).st_mtime, os.stat(self.bundle).st_size), remote)
+    self.assertRaises(delta.DeltaError, delta.update, self.url, self.dir)
+    self.assertEqual('{}', self.read('manifest.js'))
+    self.assertEqual([], [x for x in os.listdir(self.dir)
+                          if x.startswith('.staging')])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+import BaseHTTPServer
+import hashlib
+import os
+import shutil
+import SimpleHTTPServer
+import tempfile
+import threading
+import unittest
+import urllib2
+
+import download
+
+
+class QuietHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+
+  def log_message(self, *args):
+    pass
+
+
+class ETagHandler(QuietHandler):
+  """Serves files with a fixed ETag and honours If-None-Match."""
+
+  etag = '"v1"'
+
+  def send_head(self):
+    if self.headers.getheader('If-None-Match') == self.etag:
+      self.send_response(304)
+      self.end_headers()
+      return None
+    return QuietHandler.send_head(self)
+
+  def end_headers(self):
+    if self.command == 'GET':
+      self.send_header('ETag', self.etag)
+    QuietHandler.end_headers(self)
+
+
+class RangeHandler(QuietHandler):
+  """Serves files with a fixed ETag, honouring Range/If-Range.
+
+  The first truncate responses are cut off halfway through.
+  """
+
+  etag = '"v1"'
+  truncate = 0
+  ranges = []
+
+  def do_GET(self):
+    RangeHandler.ranges.append(self.headers.getheader('Range'))
+    path = self.translate_path(self.path)
+    if not os.path.isfile(path):
+      self.send_error(404, 'File not found')
+      return
+    data = open(path, 'rb').read()
+    start = 0
+    requested = self.headers.getheader('Range')
+    if requested and self.headers.getheader('If-Range') == self.etag:
+      start = int(requested.split('=')[1].rstrip('-'))
+      self.send_response(206)
+      self.send_header('Content-Range', 'bytes %d-%d/%d'
+                       % (start, len(data) - 1, len(data)))
+    else:
+      self.send_response(200)
+    self.send_header('ETag', self.etag)
+    self.send_header('Content-Length', str(len(data) - start))
+    self.end_headers()
+    body = data[start:]
+    if RangeHandler.truncate:
+      RangeHandler.truncate -= 1
+      body = body[:len(body) / 2]
+      self.close_connection = 1
+    self.wfile.write(body)
+
+
+class LocalServer(object):
+  """Serves the files in a temporary directory on localhost."""
+
+  def __init__(self, handler=QuietHandler):
+    self.root = tempfile.mkdtemp()
+    self.httpd = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), handler)
+    self.thread = threading.Thread(target=self.httpd.serve_forever)
+    self.thread.setDaemon(True)
+    self.thread.start()
+
+  def url(self, name):
+    return 'http://127.0.0.1:%d/%s' % (self.httpd.server_port, name)
+
+  def write(self, name, data):
+    f = open(os.path.join(self.root, name), 'wb')
+    f.write(data)
+    f.close()
+
+  def stop(self):
+    self.httpd.shutdown()
+    self.httpd.server_close()
+    shutil.rmtree(self.root)
+
+
+class ServerTestCase(unittest.TestCase):
+
+  handler = QuietHandler
+
+  def setUp(self):
+    self.cwd = os.getcwd()
+    self.server = LocalServer(self.handler)
+    os.chdir(self.server.root)
+    self.dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    os.chdir(self.cwd)
+    self.server.stop()
+    shutil.rmtree(self.dir)
+
+
+class DownloadTest(ServerTestCase):
+
+  def test_fetch(self):
+    self.server.write('bundle.tar.gz', 'x' * 1000)
+    path = os.path.join(self.dir, 'bundle.tar.gz')
+    download.fetch(self.server.url('bundle.tar.gz'), path)
+    self.assertEqual('x' * 1000, open(path, 'rb').read())
+
+  def test_fetch_unchanged_hash(self):
+    self.server.write('bundle.tar.gz', 'a' * 10)
+    path = os.path.join(self.dir, 'bundle.tar.gz')
+    url = self.server.url('bundle.tar.gz')
+    self.assertEqual(True, download.fetch(url, path))
+    self.assertEqual(False, download.fetch(url, path))
+    self.assertEqual(True, download.fetch(url, path, conditional=False))
+    self.server.write('bundle.tar.gz', 'b' * 10)
+    self.assertEqual(True, download.fetch(url, path))
+    self.assertEqual('b' * 10, open(path, 'rb').read())
+
+  def test_fetch_consumer(self):
+    self.server.write('bundle.tar.gz', 'x' * 1000)
+    path = os.path.join(self.dir, 'bundle.tar.gz')
+    seen = []
+    download.fetch(self.server.url('bundle.tar.gz'), path,
+                   consumer=lambda stream: seen.append(stream.read(10)),
+                   keep=False)
+    self.assertEqual(['x' * 10], seen)
+    self.assertEqual(False, os.path.exists(path))
+    self.assertEqual(hashlib.sha1('x' * 1000).hexdigest(),
+                     download.load_meta(path)['sha1'])
+
+  def test_host_limiter(self):
+    limiter = download.HostLimiter()
+    a = limiter.slot('http://example.com/a')
+    self.assert_(a is limiter.slot('http://example.com/b'))
+    self.assert_(a is not limiter.slot('http://example.org/a'))
+
+
+class ConditionalDownloadTest(ServerTestCase):
+
+  handler = ETagHandler
+
+  def test_not_modified(self):
+    self.server.write('bundle.tar.gz', 'a' * 10)
+    path = os.path.join(self.dir, 'bundle.tar.gz')
+    url = self.server.url('bundle.tar.gz')
+    self.assertEqual(True, download.fetch(url, path))
+    self.assertEqual('"v1"', download.load_meta(path)['etag'])
+    self.server.write('bundle.tar.gz', 'b' * 10)
+    self.assertEqual(False, download.fetch(url, path))
+    self.assertEqual('a' * 10, open(path, 'rb').read())
+
+
+class ResumeDownloadTest(ServerTestCase):
+
+  handler = RangeHandler
+
+  def setUp(self):
+    ServerTestCase.setUp(self)
+    RangeHandler.truncate = 0
+    RangeHandler.ranges[:] = []
+    self.backoff = download.FLAGS.download_backoff
+    download.FLAGS.download_backoff = 0
+    self.data = ''.join([chr(i % 256) for i in range(100000)])
+    self.server.write('bundle.tar.gz', self.data)
+    self.path = os.path.join(self.dir, 'bundle.tar.gz')
+    self.url = self.server.url('bundle.tar.gz')
+
+  def tearDown(self):
+    download.FLAGS.download_backoff = self.backoff
+    ServerTestCase.tearDown(self)
+
+  def test_truncated(self):
+    RangeHandler.truncate = 1
+    self.assertRaises(download.IncompleteDownload, download.fetch,
+                      self.url, self.path)
+    self.assertEqual(False, os.path.exists(self.path))
+    self.assertEqual(50000, os.path.getsize(self.path + '.part'))
+    self.assertEqual(True, download.fetch(self.url, self.path))
+    self.assertEqual([None, 'bytes=50000-'], RangeHandler.ranges)
+    self.assertEqual(self.data, open(self.path, 'rb').read())
+    self.assertEqual(hashlib.sha1(self.data).hexdigest(),
+                     download.load_meta(self.path)['sha1'])
+    self.assertEqual(False, os.path.exists(self.path + '.part'))
+
+  def test_resume_with_consumer(self):
+    RangeHandler.truncate = 1
+    seen = []
+    def consume(stream):
+      seen.append(stream.read(-1) + stream.read(-1))
+    download.fetch_retrying(self.url, self.path, 2, consumer=consume)
+    self.assertEqual(self.data, seen[-1])
+    self.assertEqual(self.data, open(self.path, 'rb').read())
+
+  def test_resume_without_keep(self):
+    RangeHandler.truncate = 1
+    seen = []
+    def consume(stream):
+      seen.append(stream.read(-1) + stream.read(-1))
+    download.fetch_retrying(self.url, self.path, 2, consumer=consume,
+                            keep=False, resume=True)
+    self.assertEqual([None, 'bytes=50000-'], RangeHandler.ranges)
+    self.assertEqual(self.data, seen[-1])
+    self.assertEqual(False, os.path.exists(self.path))
+    self.assertEqual(False, os.path.exists(self.path + '.part'))
+
+  def test_stream_without_keep_restarts(self):
+    RangeHandler.truncate = 1
+    seen = []
+    def consume(stream):
+      self.assertEqual(False, os.path.exists(self.path + '.part'))
+      seen.append(stream.read(-1) + stream.read(-1))
+    download.fetch_retrying(self.url, self.path, 2, consumer=consume,
+                            keep=False)
+    self.assertEqual([None, None], RangeHandler.ranges)
+    self.assertEqual(self.data, seen[-1])
+    self.assertEqual(False, os.path.exists(self.path + '.part'))
+    self.assertEqual(hashlib.sha1(self.data).hexdigest(),
+                     download.load_meta(self.path)['sha1'])
+
+  def test_consumer_error_on_truncation_retried(self):
+    RangeHandler.truncate = 1
+    def consume(stream):
+      if len(stream.read(-1) + stream.read(-1)) < len(self.data):
+        raise ValueError('truncated bundle')
+    download.fetch_retrying(self.url, self.path, 2, consumer=consume)
+    self.assertEqual(2, len(RangeHandler.ranges))
+
+  def test_bad_content_not_retried(self):
+    def consume(stream):
+      raise ValueError('corrupt bundle')
+    self.assertRaises(ValueError, download.fetch_retrying, self.url,
+                      self.path, 3, consumer=consume)
+    self.assertEqual(1, len(RangeHandler.ranges))
+
+  def test_retry_gives_up(self):
+    RangeHandler.truncate = 5
+    self.assertRaises(download.IncompleteDownload, download.fetch_retrying,
+                      self.url, self.path, 3, keep=False)
+    self.assertEqual(3, len(RangeHandler.ranges))
+
+  def test_missing_not_retried(self):
+    self.assertRaises(urllib2.HTTPError, download.fetch_retrying,
+                      self.server.url('missing'), self.path, 3)
+    self.assertEqual(1, len(RangeHandler.ranges))
+
+  def test_backoff(self):
+    for attempt in range(10):
+      self.assert_(0 <= download.backoff(attempt, 1, 30) <= 30)
+    self.assert_(download.backoff(0, 1, 30) <= 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import fontstore
+
+
+class CountingStore(fontstore.FontStore):
+  """Counts font cache rebuilds instead of running fc-cache.
+
+  A rebuild blocks while the gate event is clear.
+  """
+
+  gate = None
+
+  def rebuild(self):
+    self.refreshes = getattr(self, 'refreshes', 0) + 1
+    if self.gate is not None:
+      self.gate.wait()
+
+
+class FontStoreTest(unittest.TestCase):
+
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.fonts = os.path.join(self.dir, 'fonts')
+    self.store = fontstore.FontStore(self.fonts, 60)
+
+  def tearDown(self):
+    if self.store.timer is not None:
+      self.store.timer.cancel()
+    shutil.rmtree(self.dir)
+
+  def font(self, name, data):
+    path = os.path.join(self.dir, name)
+    f = open(path, 'wb')
+    f.write(data)
+    f.close()
+    return path
+
+  def test_install_once(self):
+    a = self.font('a.ttf', 'aaa')
+    self.assertEqual(1, self.store.install(1, [a]))
+    self.assert_(self.store.timer is not None)
+    self.assertEqual(0, self.store.install(2, [a]))
+    self.assertEqual(['a.ttf'], [x for x in os.listdir(self.fonts)
+                                 if not x.startswith('.')])
+
+  def test_same_name_different_font(self):
+    self.store.install(1, [self.font('a.ttf', 'aaa')])
+    os.mkdir(os.path.join(self.dir, 'other'))
+    self.assertEqual(1, self.store.install(
+        2, [self.font(os.path.join('other', 'a.ttf'), 'bbb')]))
+    self.assertEqual(3, len(os.listdir(self.fonts)))
+
+  def test_release_removes_unused(self):
+    a = self.font('a.ttf', 'aaa')
+    self.store.install(1, [a])
+    self.store.install(2, [a])
+    self.assertEqual([], self.store.release(1))
+    self.assertEqual(['a.ttf'], self.store.release(2))
+    self.assertEqual(False, os.path.exists(os.path.join(self.fonts, 'a.ttf')))
+
+  def test_keeps_foreign_fonts(self):
+    os.makedirs(self.fonts)
+    shutil.copy(self.font('a.ttf', 'aaa'), self.fonts)
+    self.assertEqual(0, self.store.install(1, [os.path.join(self.dir,
+                                                            'a.ttf')]))
+    self.assertEqual([], self.store.release(1))
+    self.assert_(os.path.exists(os.path.join(self.fonts, 'a.ttf')))
+
+  def test_persists_references(self):
+    self.store.install(1, [self.font('a.ttf', 'aaa')])
+    store = fontstore.FontStore(self.fonts, 60)
+    self.assertEqual(['a.ttf'], store.release(1))
+    store.timer.cancel()
+
+  def test_urgent_refreshes_now(self):
+    store = CountingStore(self.fonts, 60)
+    store.install(1, [self.font('a.ttf', 'aaa')], urgent=True)
+    self.assertEqual(1, store.refreshes)
+    self.assertEqual(None, store.timer)
+    store.install(2, [self.font('b.ttf', 'bbb')])
+    self.assert_(store.timer is not None)
+    store.timer.cancel()
+
+  def test_concurrent_urgent_share_refresh(self):
+    store = CountingStore(self.fonts, 60)
+    store.gate = threading.Event()
+    paths = [self.font(name, name) for name in ('a.ttf', 'b.ttf', 'c.ttf')]
+    first = threading.Thread(target=store.install, args=(1, paths[:1]),
+                             kwargs={'urgent': True})
+    first.start()
+    while getattr(store, 'refreshes', 0) < 1:
+      first.join(0.01)
+    # Both install while the first refresh runs, so one more covers both.
+    others = [threading.Thread(target=store.install, args=(i, [path]),
+                               kwargs={'urgent': True})
+              for i, path in ((2, paths[1]), (3, paths[2]))]
+    for thread in others:
+      thread.start()
+    while store.changes < 3:
+      first.join(0.01)
+    store.gate.set()
+    for thread in [first] + others:
+      thread.join()
+    self.assertEqual(2, store.refreshes)
+    self.assertEqual(3, store.refreshed)
+
+if __name__ == '__main__':
+    unittest.main()
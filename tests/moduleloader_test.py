@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import moduleloader
+
+
+class ModuleLoaderTest(unittest.TestCase):
+
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.dir, 'layout.py')
+    moduleloader.CODE_CACHE.clear()
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def write(self, source):
+    f = open(self.path, 'w')
+    f.write(source)
+    f.close()
+
+  def caches(self):
+    return [x for x in os.listdir(self.dir) if x.endswith('.pyc')]
+
+  def test_compile_cached(self):
+    self.write('value = 1\n')
+    code = moduleloader.compile_cached(self.path)
+    self.assert_(code is moduleloader.compile_cached(self.path))
+    self.assertEqual(1, len(self.caches()))
+    namespace = {}
+    exec code in namespace
+    self.assertEqual(1, namespace['value'])
+
+  def test_disk_cache(self):
+    self.write('value = 2\n')
+    moduleloader.compile_cached(self.path)
+    moduleloader.CODE_CACHE.clear()
+    cachefile = os.path.join(self.dir, self.caches()[0])
+    self.assertNotEqual(None, moduleloader.read_cache(cachefile))
+    namespace = {}
+    exec moduleloader.compile_cached(self.path) in namespace
+    self.assertEqual(2, namespace['value'])
+
+  def test_changed_source(self):
+    self.write('value = 1\n')
+    moduleloader.compile_cached(self.path)
+    self.write('value = 3\n')
+    namespace = {}
+    exec moduleloader.compile_cached(self.path) in namespace
+    self.assertEqual(3, namespace['value'])
+    self.assertEqual(1, len(self.caches()))
+
+  def test_load_slide_module(self):
+    self.write('import helper\n'
+               'value = helper.VALUE\n'
+               'data = open("data.txt").read()\n')
+    open(os.path.join(self.dir, 'helper.py'), 'w').write('VALUE = 5\n')
+    open(os.path.join(self.dir, 'data.txt'), 'w').write('hello')
+    cwd = os.getcwd()
+    path = list(sys.path)
+    module = moduleloader.load_slide_module('layout.py', self.dir)
+    self.assertEqual(cwd, os.getcwd())
+    self.assertEqual(path, sys.path)
+    self.assertEqual(5, module.value)
+    self.assertEqual('hello', module.data)
+    self.assert_(module.__package__ + '.helper' in sys.modules)
+    other = moduleloader.load_slide_module('layout.py', self.dir)
+    self.assertNotEqual(module.__package__, other.__package__)
+    removed = moduleloader.unload_package(module.__package__)
+    self.assert_(module in removed)
+    self.assertEqual([], [x for x in sys.modules
+                          if x.startswith(module.__package__)])
+    self.assertEqual(1, len(moduleloader.CODE_CACHE))
+    moduleloader.unload_package(other.__package__)
+    self.assertEqual({}, moduleloader.CODE_CACHE)
+
+  def test_load_failure_unloads(self):
+    self.write('raise ValueError("broken")\n')
+    before = set(sys.modules)
+    self.assertRaises(ValueError, moduleloader.load_slide_module,
+                      'layout.py', self.dir)
+    self.assertEqual(before, set(sys.modules))
+
+  def test_resources(self):
+    resources = moduleloader.SlideResources()
+    calls = []
+
+    def add(callback):
+      calls.append(callback)
+      return 42
+    self.assertEqual(42, resources.track_source(add, lambda: False))
+    self.assertEqual(set([42]), resources.sources)
+    calls[0]()
+    self.assertEqual(set(), resources.sources)
+    self.assertEqual({'sources': 0, 'timelines': 0, 'textures': 0},
+                     resources.report())
+
+if __name__ == '__main__':
+    unittest.main()
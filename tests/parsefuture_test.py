@@ -0,0 +1,23 @@
+#!/usr/bin/env python
+import unittest
+
+import parsefuture
+
+
+class ParseFutureTest(unittest.TestCase):
+
+  def test_result(self):
+    future = parsefuture.ParseFuture()
+    self.assertEqual(True, future.set_result(('group', 'app')))
+    self.assertEqual(('group', 'app'), future.wait(0))
+    self.assertEqual(False, future.cancel())
+
+  def test_late_result_refused(self):
+    future = parsefuture.ParseFuture()
+    self.assertRaises(parsefuture.ParseTimeout, future.wait, 0)
+    self.assertEqual(True, future.cancelled)
+    self.assertEqual(False, future.set_result(('group', 'app')))
+    self.assertEqual(None, future.result)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -63,5 +63,133 @@ class PlaylistTest(unittest.TestCase):
     self.pl.purge()
     self.assertEqual(self.pl.items, [])
 
+  def test_advance_keeps_storage(self):
+    a = object()
+    b = object()
+    self.pl.items.append(a)
+    self.pl.items.append(b)
+    self.pl.advance()
+    self.assertEqual([a,b], self.pl.items.storage)
+    self.assertEqual(b, self.pl.items.head())
+    self.pl.items.append(a)
+    self.assertEqual([b,a,a], self.pl.items)
+
+  def test_current_slide(self):
+    self.assertEqual(None, self.pl.current_slide())
+    self.pl.add({'position':1, 'mode':'single', 'slides':[4], 'weights':[1]})
+    self.pl.add({'position':2, 'mode':'single', 'slides':[7], 'weights':[1]})
+    self.assertEqual(4, self.pl.current_slide())
+    self.pl.advance()
+    self.assertEqual(7, self.pl.current_slide())
+    self.pl.rewind()
+    self.pl.rewind()
+    self.assertEqual(7, self.pl.current_slide())
+
+  def test_replace(self):
+    self.pl.add({'position':1, 'mode':'single', 'slides':[4], 'weights':[1]})
+    old = self.pl.items
+    self.pl.replace([
+        {'position':1, 'mode':'single', 'slides':[5], 'weights':[1]},
+        {'position':2, 'mode':'random', 'slides':[6], 'weights':[1]}])
+    self.assertNotEqual(old, self.pl.items)
+    self.assertEqual(1, len(old))
+    self.assertEqual(5, self.pl.current_slide())
+    self.pl.advance()
+    self.assertEqual(6, self.pl.current_slide())
+    self.pl.replace([])
+    self.assertEqual(None, self.pl.current_slide())
+
+  def test_update(self):
+    entries = [
+        {'position':1, 'mode':'single', 'slides':[1], 'weights':[1]},
+        {'position':2, 'mode':'weighted', 'slides':[2, 3], 'weights':[1, 2]},
+        {'position':3, 'mode':'single', 'slides':[4], 'weights':[1]}]
+    self.pl.replace(entries)
+    self.pl.advance()
+    self.pl.advance()
+    self.assertEqual(4, self.pl.current_slide())
+    old = self.pl.items
+    diff = self.pl.update(entries)
+    self.assertEqual(False, diff.changed())
+    self.assert_(old is self.pl.items)
+
+    weighted = old.storage[1]
+    diff = self.pl.update([
+        {'position':1, 'mode':'single', 'slides':[4], 'weights':[1]},
+        {'position':2, 'mode':'single', 'slides':[5], 'weights':[1]},
+        {'position':3, 'mode':'weighted', 'slides':[2, 3], 'weights':[1, 2]}])
+    self.assertEqual(True, diff.reordered)
+    self.assertEqual(1, len(diff.inserted))
+    self.assertEqual(1, len(diff.removed))
+    self.assertEqual([], diff.reweighted)
+    self.assert_(weighted is self.pl.items.storage[2])
+    self.assertEqual(4, self.pl.current_slide())
+    self.pl.advance()
+    self.assertEqual(5, self.pl.current_slide())
+
+    diff = self.pl.update([
+        {'position':1, 'mode':'single', 'slides':[4], 'weights':[1]},
+        {'position':2, 'mode':'single', 'slides':[5], 'weights':[1]},
+        {'position':3, 'mode':'weighted', 'slides':[2, 3], 'weights':[2, 2]}])
+    self.assertEqual(1, len(diff.reweighted))
+    self.assertEqual(False, diff.reordered)
+    self.assertEqual(5, self.pl.current_slide())
+
+  def test_upcoming(self):
+    windows = []
+    self.pl.subscribe(windows.append)
+    self.assertEqual([], self.pl.upcoming(3))
+    self.pl.replace([
+        {'position':1, 'mode':'single', 'slides':[1], 'weights':[1]},
+        {'position':2, 'mode':'random', 'slides':[2, 3, 4, 5], 'weights':[]},
+        {'position':3, 'mode':'weighted', 'slides':[6, 7], 'weights':[1, 1]}])
+    window = self.pl.upcoming(5)
+    self.assertEqual(5, len(window))
+    self.assertEqual(1, window[0])
+    self.assertEqual(window[:3], windows[-1])
+    for expected in window:
+      self.assertEqual(expected, self.pl.current_slide())
+      self.pl.advance()
+    self.assertEqual(window[2:5], windows[2])
+
+  def test_subscriber_called_unlocked(self):
+    held = []
+    def callback(window):
+      held.append(self.pl.lock.locked())
+      self.pl.current_slide()
+    self.pl.subscribe(callback)
+    self.pl.replace([
+        {'position':1, 'mode':'single', 'slides':[1], 'weights':[1]},
+        {'position':2, 'mode':'single', 'slides':[2], 'weights':[1]}])
+    self.pl.advance()
+    self.pl.update([
+        {'position':1, 'mode':'single', 'slides':[2], 'weights':[1]}])
+    self.assertEqual([False, False, False], held)
+
+
+class WeightedSlideItemTest(unittest.TestCase):
+
+  def test_distribution(self):
+    random.seed(1)
+    item = playlist.WeightedSlideItem(1, [1, 2, 3], [0.5, 1000, 0], 'weighted')
+    counts = {1: 0, 2: 0, 3: 0}
+    for unused in range(20000):
+      counts[item.slide()] += 1
+    self.assertEqual(0, counts[3])
+    self.assert_(counts[1] < 50)
+    self.assertEqual(2, len(item.aliastable[0]))
+
+  def test_even_weights(self):
+    random.seed(2)
+    item = playlist.WeightedSlideItem(1, [1, 2], [3, 3], 'weighted')
+    picks = [item.slide() for unused in range(10000)]
+    self.assert_(4500 < picks.count(1) < 5500)
+
+  def test_no_weight(self):
+    item = playlist.WeightedSlideItem(1, [], [], 'weighted')
+    self.assertEqual(None, item.slide())
+    item = playlist.WeightedSlideItem(1, [1], [0], 'weighted')
+    self.assertEqual(None, item.slide())
+
 if __name__ == '__main__':
     unittest.main()
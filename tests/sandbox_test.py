@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+import os
+import shutil
+import signal
+import tempfile
+import time
+import unittest
+
+import sandbox
+
+try:
+  import clutter
+  import gobject
+except ImportError:
+  clutter = None
+
+LAYOUT = """
+import clutter
+import time
+
+slide = clutter.Group()
+box = clutter.Rectangle(clutter.color_from_string('red'))
+box.set_size(8, 8)
+slide.add(box)
+
+
+class App(object):
+
+  def event_beforeshow(self):
+    pass
+
+  def event_loop(self):
+    time.sleep(30)
+
+app = App()
+"""
+
+
+class SandboxTest(unittest.TestCase):
+
+  def setUp(self):
+    self.handler = signal.signal(signal.SIGPROF, sandbox.on_cpu_budget)
+
+  def tearDown(self):
+    signal.signal(signal.SIGPROF, self.handler)
+
+  def test_line_reader(self):
+    reader = sandbox.LineReader()
+    self.assertEqual(reader.feed('{"frame": 0}\n{"id"'), [{'frame': 0}])
+    self.assertEqual(reader.feed(': 1}\n\n'), [{'id': 1}])
+    self.assertEqual(reader.buffer, '')
+
+  def test_within_budget(self):
+    used = sandbox.run_budgeted(lambda: None, 1.0)
+    self.assertTrue(used < 1.0)
+
+  def test_over_budget(self):
+    def spin():
+      while True:
+        pass
+    self.assertRaises(sandbox.BudgetExceeded, sandbox.run_budgeted, spin, 0.05)
+
+
+class SandboxProcessTest(unittest.TestCase):
+  """Runs a real sandbox worker; needs clutter and a display."""
+
+  def setUp(self):
+    if clutter is None:
+      self.skipTest('needs clutter and gobject')
+    self.dir = tempfile.mkdtemp()
+    path = os.path.join(self.dir, 'layout.py')
+    f = open(path, 'w')
+    f.write(LAYOUT)
+    f.close()
+    self.wall = sandbox.FLAGS.sandbox_wall_budget
+    sandbox.FLAGS.sandbox_wall_budget = 500
+    self.client = sandbox.SandboxClient(self.dir, path, 16, 16)
+    self.frames = []
+    handle = self.client.handle
+    def record(message):
+      if 'frame' in message:
+        self.frames.append(message['frame'])
+      handle(message)
+    self.client.handle = record
+
+  def tearDown(self):
+    self.client.close()
+    sandbox.FLAGS.sandbox_wall_budget = self.wall
+    shutil.rmtree(self.dir)
+
+  def run_until(self, condition, timeout=10):
+    context = gobject.main_context_default()
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+      while context.pending():
+        context.iteration(False)
+      time.sleep(0.01)
+    return condition()
+
+  def test_started_lazily(self):
+    self.assertEqual(None, self.client.process)
+
+  def test_frame_and_budget_kill(self):
+    self.client.event_beforeshow()
+    self.assert_(self.client.process is not None)
+    self.assert_(self.run_until(lambda: self.frames))
+    self.client.event_loop()
+    self.assert_(self.run_until(lambda: self.client.process is None))
+    self.assertEqual(1, self.client.restarts)
+    self.client.event_aftershow()
+    self.assert_(self.client.process is not None)
+
+  def test_no_frames_when_hidden(self):
+    self.client.event_afterhide()
+    self.assertEqual(False, self.run_until(lambda: self.frames, timeout=1))
+
+if __name__ == '__main__':
+    unittest.main()
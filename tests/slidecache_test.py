@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import slidecache
+
+
+class SlideCacheTest(unittest.TestCase):
+
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.cache = slidecache.SlideCache(self.dir)
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def slide(self, name, size, shown):
+    os.mkdir(os.path.join(self.dir, name))
+    f = open(os.path.join(self.dir, name, 'bundle.tar.gz'), 'wb')
+    f.write('x' * size)
+    f.close()
+    self.cache.touch(name, shown)
+
+  def remaining(self):
+    return sorted([x for x in os.listdir(self.dir) if not x.startswith('.')])
+
+  def in_thread(self, func):
+    result = []
+    worker = threading.Thread(target=lambda: result.append(func()))
+    worker.start()
+    worker.join()
+    return result[0]
+
+  def evict(self, quota, wanted):
+    """Evict the way Manager.check_cache and evict_cache do."""
+    entries = self.in_thread(self.cache.entries)
+    victims = self.cache.select(entries, quota, wanted)
+    for name in victims:
+      self.assertEqual(True, self.cache.trash(name))
+    self.in_thread(lambda: (self.cache.empty_trash(), self.cache.save()))
+    self.assertEqual([], [x for x in os.listdir(self.dir)
+                          if x.startswith(slidecache.TRASH)])
+    return victims
+
+  def test_evicts_least_recently_shown(self):
+    self.slide('1', 100, 10)
+    self.slide('2', 100, 30)
+    self.slide('3', 100, 20)
+    self.assertEqual(['1', '3'], self.evict(150, set()))
+    self.assertEqual(['2'], self.remaining())
+
+  def test_under_quota(self):
+    self.slide('1', 100, 10)
+    self.assertEqual([], self.evict(1000, set()))
+    self.assertEqual(['1'], self.remaining())
+
+  def test_keeps_protected(self):
+    self.slide('1', 100, 10)
+    self.slide('2', 100, 20)
+    self.slide('3', 100, 30)
+    self.assertEqual(['2'], self.evict(200, set(['1'])))
+    self.assertEqual(['1', '3'], self.remaining())
+    self.assertEqual([], self.evict(0, set(['1', '3'])))
+
+  def test_persists_last_shown(self):
+    self.slide('1', 100, 30)
+    self.slide('2', 100, 10)
+    self.cache.save()
+    cache = slidecache.SlideCache(self.dir)
+    self.assertEqual(['2', '1'], [name for unused_shown, name, unused_size
+                                  in cache.entries()])
+    self.cache = cache
+    self.assertEqual(['2'], self.evict(100, set()))
+    self.assertEqual(False, '2' in slidecache.SlideCache(self.dir).shown)
+
+  def test_trash_before_removal(self):
+    self.slide('1', 100, 10)
+    self.assertEqual(['1'], self.cache.select(self.cache.entries(), 0, set()))
+    self.assertEqual(True, self.cache.trash('1'))
+    self.assertEqual([], self.remaining())
+    self.assertEqual([], self.cache.entries())
+    os.mkdir(os.path.join(self.dir, '1'))
+    self.cache.empty_trash()
+    self.assertEqual(['1'], [x for x in os.listdir(self.dir)
+                             if not x.startswith('.')])
+
+  def test_wanted_while_measuring(self):
+    self.slide('1', 100, 10)
+    self.slide('2', 100, 20)
+    entries = self.in_thread(self.cache.entries)
+    # Slide 1 started loading after the measurement, before the eviction.
+    victims = self.cache.select(entries, 100, set(['1']))
+    self.assertEqual(['2'], victims)
+    self.cache.trash('2')
+    self.assertEqual(['1'], self.remaining())
+
+  def test_touch_saves(self):
+    self.cache.touch('1', 10)
+    self.assertEqual({'1': 10}, slidecache.SlideCache(self.dir).shown)
+    self.cache.touch('1', 20)
+    self.assertEqual({'1': 10}, slidecache.SlideCache(self.dir).shown)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+import os
+import shutil
+import tempfile
+import unittest
+import xmlrpclib
+
+import slideindex
+
+
+class SlideIndexTest(unittest.TestCase):
+
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.dir, 'index.js')
+    self.index = slideindex.SlideIndex(self.path)
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def test_roundtrip(self):
+    self.index.set_playlist({
+        'slides': [{'id': 1, 'modified': 'a', 'url': 'u1'}],
+        'playlist': [{'position': 1, 'mode': 'single', 'slides': [1],
+                      'weights': [1]}]})
+    self.index.set_slide({'id': 2, 'modified': 'b', 'url': 'u2'})
+    self.index.remove_slide(1)
+    self.index.save()
+    loaded = slideindex.SlideIndex(self.path)
+    self.assertEqual(True, loaded.load())
+    self.assertEqual([2], loaded.slides.keys())
+    self.assertEqual('u2', loaded.slides[2]['url'])
+    self.assertEqual([1], loaded.playlist[0]['slides'])
+
+  def test_xmlrpc_values(self):
+    modified = xmlrpclib.DateTime('20261018T09:30:00')
+    self.index.set_slide({'id': 1, 'modified': modified,
+                          'thumb': xmlrpclib.Binary('\x00\xff')})
+    self.index.save()
+    loaded = slideindex.SlideIndex(self.path)
+    self.assertEqual(True, loaded.load())
+    restored = loaded.slides[1]
+    self.assertEqual(slideindex.comparable(modified),
+                     slideindex.comparable(restored['modified']))
+    self.assertEqual('\x00\xff', restored['thumb'].decode('base64'))
+
+  def test_missing_or_corrupt(self):
+    self.assertEqual(False, self.index.load())
+    open(self.path, 'w').write('{not json')
+    self.assertEqual(False, self.index.load())
+    open(self.path, 'w').write('{"version": 99}')
+    self.assertEqual(False, self.index.load())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -11,7 +11,19 @@ FLAGS = flags.FLAGS
 #from slideobject_test import SlideObjectTest
 #from xmppthread_test import XMPPThreadTest
 from config_test import ConfigTest
-from playlist_test import PlaylistTest
+from playlist_test import PlaylistTest, WeightedSlideItemTest
+from collection_test import CollectionTest
+from commandqueue_test import CommandQueueTest
+from download_test import DownloadTest, ConditionalDownloadTest
+from download_test import ResumeDownloadTest
+from bundle_test import BundleTest
+from delta_test import DeltaTest
+from fontstore_test import FontStoreTest
+from slideindex_test import SlideIndexTest
+from slidecache_test import SlideCacheTest
+from moduleloader_test import ModuleLoaderTest
+from parsefuture_test import ParseFutureTest
+from sandbox_test import SandboxTest, SandboxProcessTest
 
 if __name__ == '__main__':
     FLAGS(sys.argv)